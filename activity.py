@@ -965,7 +965,7 @@ class SpeakActivity(activity.Activity):
 
             # speak the text
             if self._mode == MODE_BOT:
-                self.face.say(brain.respond(text))
+                brain.respond_async(text, self.face.say)
             else:
                 self.face.say(text)
 
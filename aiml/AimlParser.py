@@ -4,6 +4,7 @@ A parser for AIML files
 
 from __future__ import print_function
 
+from xml.parsers import expat
 from xml.sax.handler import ContentHandler
 from xml.sax.xmlreader import Locator
 import sys
@@ -34,15 +35,18 @@ class AimlHandler(ContentHandler):
     _STATE_AfterTemplate  = 8
 
 
-    def __init__(self, encoding=None):
+    def __init__(self, encoding=None, categoryHandler=None):
         self.categories = {}
+        self._categoryHandler = categoryHandler
         self._encoding = encoding
         self._state = self._STATE_OutsideAiml
         self._version = ""
         self._namespace = ""
         self._forwardCompatibleMode = False
-        self._currentPattern = ""
-        self._currentThat    = ""
+        # the text of the current <pattern> and <that>, as a list of
+        # pieces that is joined once the category ends
+        self._currentPattern = []
+        self._currentThat    = []
         self._currentTopic   = ""
         self._insideTopic = False
         self._currentUnknown = "" # the name of the current unknown element
@@ -73,6 +77,10 @@ class AimlHandler(ContentHandler):
         self._whitespaceBehaviorStack = ["default"]
         
         self._elemStack = []
+        # the last "text" element of the current template, and the pieces
+        # of its text, which are joined into it once it is complete
+        self._textElem = None
+        self._textPieces = []
         self._locator = Locator()
         self.setDocumentLocator(self._locator)
 
@@ -87,6 +95,15 @@ class AimlHandler(ContentHandler):
         """
         self._encoding = encoding
 
+    def setCategoryHandler(self, categoryHandler):
+        """
+        Set a function to be called with the (pattern, that, topic) key
+        and the template of each category as soon as its </category>
+        tag is read, instead of storing the category in the categories
+        dictionary.  None (the default) stores the categories.
+        """
+        self._categoryHandler = categoryHandler
+
     def _location(self):
         "Return a string describing the current location in the source file."
         line = self._locator.getLineNumber()
@@ -142,6 +159,12 @@ class AimlHandler(ContentHandler):
             if self._state >= self._STATE_InsideCategory:
                 self._skipCurrentCategory = True
             
+    def _endText(self):
+        "Join the pieces of the text element being read."
+        self._textElem[2] = u"".join(self._textPieces)
+        self._textElem = None
+        self._textPieces = []
+
     def _startElement(self, name, attr):
         if name == "aiml":
             # <aiml> tags are only legal in the OutsideAiml state
@@ -185,8 +208,10 @@ class AimlHandler(ContentHandler):
             if self._state != self._STATE_InsideAiml:
                 raise AimlParserError( "Unexpected <category> tag "+self._location() )
             self._state = self._STATE_InsideCategory
-            self._currentPattern = u""
-            self._currentThat = u""
+            self._currentPattern = []
+            self._currentThat = []
+            self._textElem = None
+            self._textPieces = []
             # If we're not inside a topic, the topic is implicitly set to *
             if not self._insideTopic: self._currentTopic = u"*"
             self._elemStack = []
@@ -208,7 +233,7 @@ class AimlHandler(ContentHandler):
                 raise AimlParserError( "Unexpected <template> tag "+self._location() )
             # if no <that> element was specified, it is implicitly set to *
             if self._state == self._STATE_AfterPattern:
-                self._currentThat = u"*"
+                self._currentThat = [u"*"]
             self._state = self._STATE_InsideTemplate
             self._elemStack.append(['template',{}])
             self._pushWhitespaceBehavior(attr)
@@ -217,7 +242,7 @@ class AimlHandler(ContentHandler):
             if name == "bot" and "name" in attr and attr["name"] == u"name":
                 # Insert a special character string that the PatternMgr will
                 # replace with the bot's name.
-                self._currentPattern += u" BOT_NAME "
+                self._currentPattern.append(u" BOT_NAME ")
             else:
                 raise AimlParserError( ( "Unexpected <%s> tag " % name)+self._location() )
         elif self._state == self._STATE_InsideThat:
@@ -225,7 +250,7 @@ class AimlHandler(ContentHandler):
             if name == "bot" and "name" in attr and attr["name"] == u"name":
                 # Insert a special character string that the PatternMgr will
                 # replace with the bot's name.
-                self._currentThat += u" BOT_NAME "
+                self._currentThat.append(u" BOT_NAME ")
             else:
                 raise AimlParserError( ("Unexpected <%s> tag " % name)+self._location() )
         elif self._state == self._STATE_InsideTemplate and name in self._validInfo:
@@ -277,10 +302,15 @@ class AimlHandler(ContentHandler):
         text = unicode(ch)
         if self._state == self._STATE_InsidePattern:
             # TODO: text inside patterns must be upper-case!
-            self._currentPattern += text
+            self._currentPattern.append(text)
         elif self._state == self._STATE_InsideThat:
-            self._currentThat += text
+            self._currentThat.append(text)
         elif self._state == self._STATE_InsideTemplate:
+            # If the text continues the text element at the top of the
+            # element stack, its parent has already been validated.
+            if self._textElem is not None and self._elemStack[-1][-1] is self._textElem:
+                self._textPieces.append(text)
+                return
             # First, see whether the element at the top of the element stack
             # is permitted to contain text.
             try:
@@ -307,14 +337,11 @@ class AimlHandler(ContentHandler):
             
             # Add a new text element to the element at the top of the element
             # stack. If there's already a text element there, simply append the
-            # new characters to its contents.
-            try: textElemOnStack = (self._elemStack[-1][-1][0] == "text")
-            except IndexError: textElemOnStack = False
-            except KeyError: textElemOnStack = False
-            if textElemOnStack:
-                self._elemStack[-1][-1][2] += text
-            else:
-                self._elemStack[-1].append(["text", {"xml:space": self._whitespaceBehaviorStack[-1]}, text])
+            # new characters to its contents, once it is complete (see above).
+            if self._textElem is not None: self._endText()
+            self._textElem = ["text", {"xml:space": self._whitespaceBehaviorStack[-1]}, text]
+            self._textPieces.append(text)
+            self._elemStack[-1].append(self._textElem)
         else:
             # all other text is ignored
             pass
@@ -376,10 +403,16 @@ class AimlHandler(ContentHandler):
             if self._state != self._STATE_AfterTemplate:
                 raise AimlParserError( "Unexpected </category> tag "+self._location() )
             self._state = self._STATE_InsideAiml
-            # End the current category.  Store the current pattern/that/topic and
-            # element in the categories dictionary.
-            key = (self._currentPattern.strip(), self._currentThat.strip(),self._currentTopic.strip())
-            self.categories[key] = self._elemStack[-1]
+            # End the current category.  Pass the current pattern/that/topic
+            # and element to the category handler, or store them in the
+            # categories dictionary.
+            key = (u"".join(self._currentPattern).strip(), u"".join(self._currentThat).strip(),
+                   self._currentTopic.strip())
+            if self._categoryHandler is not None:
+                self._categoryHandler(key, self._elemStack[-1])
+            else:
+                self.categories[key] = self._elemStack[-1]
+            self._elemStack = []
             self._whitespaceBehaviorStack.pop()
         elif name == "pattern":
             # </pattern> tags are only legal in the InsidePattern state
@@ -396,6 +429,7 @@ class AimlHandler(ContentHandler):
                 raise AimlParserError( "Unexpected </template> tag "+self._location() )
             self._state = self._STATE_AfterTemplate
             self._whitespaceBehaviorStack.pop()
+            if self._textElem is not None: self._endText()
         elif self._state == self._STATE_InsidePattern:
             # Certain tags are allowed inside <pattern> elements.
             if name not in ["bot"]:
@@ -546,10 +580,113 @@ class AimlHandler(ContentHandler):
         # All is well!
         return True
 
-def create_parser():
-    """Create and return an AIML parser object."""
-    parser = xml.sax.make_parser()
+class ExpatAimlParser(Locator):
+    '''
+    An AIML parser driving an AimlHandler straight from xml.parsers.expat
+
+    This does what the xml.sax parser does for the AimlHandler, with the
+    same element names, attributes, text and locations, and the same
+    xml.sax.SAXParseException for a document that is not well-formed,
+    without the SAX layer in between.  It is also its own locator.
+    '''
+
+    _bufferSize = 2**16
+
+    def __init__(self, handler=None):
+        self._handler = handler
+        self._parser = None
+        self._systemId = None
+
+    def getContentHandler(self):
+        return self._handler
+
+    def setContentHandler(self, handler):
+        self._handler = handler
+
+    def getColumnNumber(self):
+        return self._parser.CurrentColumnNumber if self._parser else None
+
+    def getLineNumber(self):
+        return self._parser.CurrentLineNumber if self._parser else 1
+
+    def getPublicId(self):
+        return None
+
+    def getSystemId(self):
+        return self._systemId
+
+    def _reset(self):
+        handler = self._handler
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = handler.startElement
+        self._parser.EndElementHandler = handler.endElement
+        self._parser.CharacterDataHandler = handler.characters
+        handler.setDocumentLocator(self)
+
+    def parse(self, source):
+        """Parse an AIML document, given as a file name or a binary
+        file object."""
+        if hasattr(source, "read"):
+            self._systemId = getattr(source, "name", None)
+            self._parseFile(source)
+        else:
+            self._systemId = source
+            with open(source, "rb") as f:
+                self._parseFile(f)
+
+    def _parseFile(self, f):
+        self._reset()
+        try:
+            # in blocks as large as those of xml.sax, which splits the
+            # text less than ParseFile() would
+            while True:
+                data = f.read(self._bufferSize)
+                self._parser.Parse(data, not data)
+                if not data: break
+        except expat.error as e:
+            raise xml.sax.SAXParseException(expat.ErrorString(e.code), e, self)
+
+    def feed(self, data):
+        """Parse the next chunk of an AIML document."""
+        if self._parser is None:
+            self._reset()
+        try:
+            self._parser.Parse(data, False)
+        except expat.error as e:
+            raise xml.sax.SAXParseException(expat.ErrorString(e.code), e, self)
+
+    def close(self):
+        """Finish parsing the document given to feed()."""
+        try:
+            self._parser.Parse(b"", True)
+        except expat.error as e:
+            raise xml.sax.SAXParseException(expat.ErrorString(e.code), e, self)
+        finally:
+            self._parser = None
+
+
+# The parser create_parser() returns by default: "sax" for the xml.sax
+# parser, or "expat" for an ExpatAimlParser.  bench_parser.py shows no
+# consistent difference in speed between the two, so the default stays
+# the standard xml.sax parser.
+defaultBackend = "sax"
+
+def create_parser(backend=None):
+    """Create and return an AIML parser object.
+
+    backend is "sax" for the parser of xml.sax, or "expat" for an
+    ExpatAimlParser; by default, defaultBackend.  Both have the parse(),
+    feed() and close() methods of xml.sax parsers, and report errors as
+    they do.
+    """
+    if backend is None:
+        backend = defaultBackend
     handler = AimlHandler("UTF-8")
+    if backend == "expat":
+        return ExpatAimlParser(handler)
+    elif backend != "sax":
+        raise ValueError("unknown AIML parser backend %r" % (backend,))
+    parser = xml.sax.make_parser()
     parser.setContentHandler(handler)
     #parser.setFeature(xml.sax.handler.feature_namespaces, True)
     return parser
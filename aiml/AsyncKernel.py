@@ -0,0 +1,110 @@
+'''
+The asyncio front end of the Kernel: see Kernel.respond_async().
+
+The Kernel itself is synchronous.  Each response is computed by
+Kernel.respond() in an executor thread, which holds a _Request: its
+<system> elements hand their command back to the event loop, to run as
+an asyncio subprocess, and the Kernel checks it at every <srai> to stop
+as soon as the response is cancelled.
+
+This module needs Python 3.7 or later; the Kernel only imports it when
+respond_async() is used.
+'''
+
+import asyncio
+import locale
+import os
+import signal
+
+
+class _Request(object):
+    """The state of one respond_async() call, shared by the coroutine
+    awaiting the response and the thread computing it."""
+
+    def __init__(self, loop, systemTimeout):
+        self.loop = loop
+        self.systemTimeout = systemTimeout
+        self.cancelled = False
+        self._process = None
+
+    def check(self):
+        """Raise CancelledError if the request has been cancelled.
+        Called from the executor thread."""
+        if self.cancelled:
+            raise asyncio.CancelledError()
+
+    def cancel(self):
+        """Cancel the request, killing its <system> command if one is
+        running.  Called from the event loop."""
+        self.cancelled = True
+        if self._process is not None:
+            self._kill(self._process)
+
+    def _kill(self, process):
+        # Kill the shell and whatever it started, which could otherwise
+        # keep its output open.
+        if process.returncode is not None:
+            return
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        else:
+            process.kill()
+
+    def system(self, command):
+        """Run the shell command in the event loop and return the lines
+        of its output.  Called from the executor thread, which blocks
+        until the command is done.
+
+        Raises RuntimeError if the command times out.
+
+        """
+        self.check()
+        future = asyncio.run_coroutine_threadsafe(self._system(command), self.loop)
+        lines = future.result()
+        self.check()
+        return lines
+
+    async def _system(self, command):
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE,
+            start_new_session=hasattr(os, "killpg"))
+        self._process = process
+        try:
+            if self.cancelled:
+                self._kill(process)
+            try:
+                out, err = await asyncio.wait_for(process.communicate(), self.systemTimeout)
+            except asyncio.TimeoutError:
+                self._kill(process)
+                await process.wait()
+                raise RuntimeError("command timed out after %s seconds: %s"
+                                   % (self.systemTimeout, command))
+        finally:
+            self._process = None
+        text = out.decode(locale.getpreferredencoding(False), "replace")
+        return text.splitlines(True)
+
+
+def _respond(kernel, request, input_, sessionID):
+    # runs in the executor thread
+    kernel._local.request = request
+    try:
+        return kernel.respond(input_, sessionID)
+    finally:
+        kernel._local.request = None
+
+
+async def respond(kernel, input_, sessionID, executor, systemTimeout):
+    """Return the Kernel's response to the input string, computed in
+    executor.  See Kernel.respond_async()."""
+    loop = asyncio.get_running_loop()
+    request = _Request(loop, systemTimeout)
+    try:
+        return await loop.run_in_executor(executor, _respond, kernel, request,
+                                          input_, sessionID)
+    except asyncio.CancelledError:
+        request.cancel()
+        raise
@@ -0,0 +1,267 @@
+'''
+A memory-mappable on-disk format for CompactPatternMgr brains.
+
+Unlike the marshal format written by PatternMgr.save(), nothing is
+deserialised when a brain file is loaded: the file is mmap()ed and the
+node, edge and string tables are used in place, so loading takes
+constant time and only the pages visited while matching are ever read.
+
+Layout (all integers little-endian, sections aligned to 8 bytes):
+
+    header           magic, version, counts, bot name and the offset of
+                     each of the sections below
+    edge starts      uint32[nodes+1]  first edge of each node
+    node templates   int32[nodes]     template index of each node, or -1
+    edge labels      uint32[edges]    word id of each edge
+    edge targets     uint32[edges]    node reached by each edge
+    word offsets     uint64[words+1]  offsets into the word data
+    word data        UTF-8 words, sorted, so that word ids can be found
+                     by binary search
+    template offsets uint64[templates+1]  offsets into the template data
+    template data    marshal()ed templates, decoded by the PatternMgr
+                     when a match selects them
+'''
+
+from __future__ import print_function
+
+from array import array
+import marshal
+import mmap
+import struct
+import sys
+
+from .constants import *
+
+MAGIC = b"PYAIMLBM"
+VERSION = 1
+
+# magic, version, node count, edge count, word count, template count,
+# category count, bot name length, 8 section offsets
+_header = struct.Struct("<8sIIIIIII8Q")
+_align = 8
+
+
+def isBrainFile(filename):
+    """Return True if filename is a brain file in this format."""
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+class _Strings(object):
+    """A read-only sequence of strings stored as an offset table and a
+    blob of UTF-8 data."""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._data[self._offsets[i]:self._offsets[i+1]].tobytes().decode("utf-8")
+
+
+class _Templates(_Strings):
+    """A read-only sequence of marshal()ed templates."""
+
+    def __getitem__(self, i):
+        return self._data[self._offsets[i]:self._offsets[i+1]].tobytes()
+
+
+class WordList(object):
+    """The id -> word half of a mapped intern table.
+
+    Ids from 'first' up to first+len(words) are the sorted words stored
+    in the file.  Words interned after loading are kept in memory.
+    """
+
+    def __init__(self, first, words):
+        self._first = first
+        self._words = words
+        self._extra = []
+
+    def __len__(self):
+        return self._first + len(self._words) + len(self._extra)
+
+    def __getitem__(self, wordId):
+        if wordId < self._first:
+            return None
+        i = wordId - self._first
+        if i < len(self._words):
+            return self._words[i]
+        return self._extra[i - len(self._words)]
+
+    def append(self, word):
+        self._extra.append(word)
+
+
+class WordIds(object):
+    """The word -> id half of a mapped intern table.
+
+    Words are found by binary search in the sorted string pool, and the
+    results are cached.
+    """
+
+    def __init__(self, first, words):
+        self._first = first
+        self._words = words
+        self._cache = {}
+
+    def __getitem__(self, word):
+        try:
+            return self._cache[word]
+        except KeyError:
+            pass
+        words = self._words
+        lo, hi = 0, len(words)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if words[mid] < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(words) and words[lo] == word:
+            self._cache[word] = self._first + lo
+            return self._first + lo
+        raise KeyError(word)
+
+    def __setitem__(self, word, wordId):
+        self._cache[word] = wordId
+
+    def __contains__(self, word):
+        try:
+            self[word]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+
+class BrainFile(object):
+    """A brain file opened with load().
+
+    The tables are exposed as attributes: edgeStart, nodeTemplates,
+    edgeLabels and edgeTargets are integer sequences, wordIds and
+    wordList form the intern table, and templates is a sequence of
+    marshal()ed templates.
+    """
+
+    def __init__(self, filename, firstWordId):
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        fields = _header.unpack_from(view, 0)
+        magic, version, nodes, edges, wordCount, templateCount, categories, nameLen = fields[:8]
+        offsets = fields[8:]
+        if magic != MAGIC:
+            raise ValueError("%s is not a brain file" % filename)
+        if version != VERSION:
+            raise ValueError("%s has unsupported brain file version %d" % (filename, version))
+
+        def table(i, code, count):
+            size = array(code).itemsize
+            data = view[offsets[i]:offsets[i] + count * size]
+            if sys.byteorder == "little":
+                return data.cast(code)
+            # The file is little-endian; fall back to an in-memory copy.
+            copy = array(code, data.tobytes())
+            copy.byteswap()
+            return copy
+
+        self.templateCount = categories
+        self.botName = view[_header.size:_header.size + nameLen].tobytes().decode("utf-8")
+        self.edgeStart = table(0, "I", nodes + 1)
+        self.nodeTemplates = table(1, "i", nodes)
+        self.edgeLabels = table(2, "I", edges)
+        self.edgeTargets = table(3, "I", edges)
+        wordData = view[offsets[5]:offsets[6]]
+        words = _Strings(table(4, "Q", wordCount + 1), wordData)
+        self.wordIds = WordIds(firstWordId, words)
+        self.wordList = WordList(firstWordId, words)
+        templateData = view[offsets[7]:]
+        self.templates = _Templates(table(6, "Q", templateCount + 1), templateData)
+
+
+def load(filename, firstWordId):
+    """Map the brain file filename and return a BrainFile."""
+    return BrainFile(filename, firstWordId)
+
+
+def _encode(template):
+    if isinstance(template, bytes):
+        return template
+    return marshal.dumps(template)
+
+
+def save(filename, templateCount, botName, edgeStart, nodeTemplates,
+         edgeLabels, edgeTargets, wordList, templates, firstWordId):
+    """Write a compacted node tree to filename.
+
+    The arguments are the tables of a CompactPatternMgr.  Word ids are
+    renumbered so that the words are stored in sorted order.
+    """
+    words = sorted(wordList[i] for i in range(firstWordId, len(wordList)))
+    newIds = dict((word, firstWordId + i) for i, word in enumerate(words))
+
+    # Relabel the edges, keeping the edges of each node sorted by id.
+    labels = array("I")
+    targets = array("I")
+    for n in range(len(edgeStart) - 1):
+        edges = []
+        for i in range(edgeStart[n], edgeStart[n+1]):
+            label = edgeLabels[i]
+            if label >= firstWordId:
+                label = newIds[wordList[label]]
+            edges.append((label, edgeTargets[i]))
+        edges.sort()
+        for label, target in edges:
+            labels.append(label)
+            targets.append(target)
+
+    def pool(items):
+        offsets = array("Q", [0])
+        data = []
+        for item in items:
+            data.append(item)
+            offsets.append(offsets[-1] + len(item))
+        return offsets, b"".join(data)
+
+    wordOffsets, wordData = pool([word.encode("utf-8") for word in words])
+    templateOffsets, templateData = pool([_encode(templates[i]) for i in range(len(templates))])
+    name = botName.encode("utf-8")
+
+    sections = [array("I", edgeStart), array("i", nodeTemplates), labels,
+                targets, wordOffsets, wordData, templateOffsets, templateData]
+    chunks = []
+    offsets = []
+    pos = _header.size + len(name)
+    for section in sections:
+        pos += -pos % _align
+        offsets.append(pos)
+        if isinstance(section, array):
+            if sys.byteorder != "little":
+                section = array(section.typecode, section)
+                section.byteswap()
+            section = section.tobytes()
+        chunks.append(section)
+        pos += len(section)
+
+    with open(filename, "wb") as outFile:
+        outFile.write(_header.pack(MAGIC, VERSION, len(nodeTemplates), len(labels),
+                                   len(words), len(templates), templateCount,
+                                   len(name), *offsets))
+        outFile.write(name)
+        pos = _header.size + len(name)
+        for offset, chunk in zip(offsets, chunks):
+            outFile.write(b"\0" * (offset - pos))
+            outFile.write(chunk)
+            pos = offset + len(chunk)
@@ -0,0 +1,274 @@
+'''
+This class stores the PatternMgr node tree in flat arrays instead of
+nested dictionaries, which takes a fraction of the memory for large
+brains.
+'''
+
+from __future__ import print_function
+
+from array import array
+from bisect import bisect_left
+import pprint
+
+from .constants import *
+from . import BrainFile
+from .PatternMgr import PatternMgr
+
+class CompactPatternMgr(PatternMgr):
+    """A PatternMgr backed by an array-based trie.
+
+    Every word is interned into an integer id, and each node's children
+    are kept as a sorted run of (word id, child node) pairs in two flat
+    array('I') tables:
+
+        _edgeStart[n] .. _edgeStart[n+1]   slice of the edge tables
+                                           holding node n's children
+        _edgeLabels[i]                     word id of edge i (sorted
+                                           within each node)
+        _edgeTargets[i]                    node reached by edge i
+        _nodeTemplates[n]                  index into _templates, or -1
+
+    Ids below _FIRST_WORD_ID are the special keys (_UNDERSCORE, _STAR,
+    _THAT, ...) so they keep the same priority as in the dict tree.
+
+    The arrays cannot be grown in place, so categories are first added
+    to an ordinary dict tree which is compacted the next time a match is
+    requested.  Adding to an already compacted tree expands it back into
+    dicts first; this is cheap enough for the occasional <learn>, but
+    bulk loading should be done before matching starts.
+
+    The tables can also be memory-mapped from a file written by
+    saveMapped() (see the BrainFile module), in which case restore()
+    takes constant time and the tables are read from disk on demand.
+    """
+    _FIRST_WORD_ID = 6
+
+    def __init__(self):
+        PatternMgr.__init__(self)
+        self._wordIds = {}
+        self._wordList = [None] * self._FIRST_WORD_ID
+        self._edgeStart = array('I', [0, 0])
+        self._edgeLabels = array('I')
+        self._edgeTargets = array('I')
+        self._nodeTemplates = array('i', [-1])
+        self._templates = []
+
+    @classmethod
+    def fromPatternMgr(cls, other):
+        """Return a compacted copy of the dict-based PatternMgr other.
+
+        The templates are shared with other, not copied.
+        """
+        pm = cls()
+        pm._templateCount = other._templateCount
+        pm._botName = other._botName
+        pm._root = other._root
+        pm._compact()
+        return pm
+
+    def dump(self):
+        """Print all learned patterns, for debugging purposes."""
+        pprint.pprint(self._toDict())
+
+    def save(self, filename):
+        """Dump the current patterns to the file specified by filename.
+
+        The file has the same format as PatternMgr.save(), so brains can
+        be moved freely between the two classes.
+        """
+        compacted = self._root is None
+        self._thaw()
+        try:
+            PatternMgr.save(self, filename)
+        finally:
+            if compacted:
+                self._compact()
+
+    def saveMapped(self, filename):
+        """Write the patterns to filename in the memory-mappable BrainFile
+        format.  To restore later, use restore().
+        """
+        self._compact()
+        try:
+            BrainFile.save(filename, self._templateCount, self._botName,
+                           self._edgeStart, self._nodeTemplates,
+                           self._edgeLabels, self._edgeTargets,
+                           self._wordList, self._templates,
+                           self._FIRST_WORD_ID)
+        except Exception as e:
+            print( "Error saving PatternMgr to file %s:" % filename )
+            raise
+
+    def restore(self, filename):
+        """Restore a previously save()d or saveMapped() collection of
+        patterns.
+        """
+        if BrainFile.isBrainFile(filename):
+            try:
+                brain = BrainFile.load(filename, self._FIRST_WORD_ID)
+            except Exception as e:
+                print( "Error restoring PatternMgr from file %s:" % filename )
+                raise
+            self._templateCount = brain.templateCount
+            self._botName = brain.botName
+            self._edgeStart = brain.edgeStart
+            self._nodeTemplates = brain.nodeTemplates
+            self._edgeLabels = brain.edgeLabels
+            self._edgeTargets = brain.edgeTargets
+            self._wordIds = brain.wordIds
+            self._wordList = brain.wordList
+            self._templates = brain.templates
+            self._root = None
+            self._forgetStats()
+            return
+        self._wordIds = {}
+        self._wordList = [None] * self._FIRST_WORD_ID
+        PatternMgr.restore(self, filename)
+        self._compact()
+
+    def add(self, data, template):
+        """Add a [pattern/that/topic] tuple and its corresponding template
+        to the node tree.
+        """
+        self._thaw()
+        PatternMgr.add(self, data, template)
+
+    def remove(self, data):
+        """Remove the template of a [pattern/that/topic] tuple from the
+        node tree.  Returns False if there was no such template.
+        """
+        self._thaw()
+        return PatternMgr.remove(self, data)
+
+    def freeze(self):
+        """Compact the node tree and intern the bot name, which match()
+        would otherwise do on the next call.
+        """
+        self._compact()
+        self._intern(self._botName)
+
+    def _forgetStats(self, nodes=None):
+        """Drop all the statistics of _wildcardStats(): the nodes are
+        numbered again when the tree is compacted."""
+        PatternMgr._forgetStats(self)
+
+    def _intern(self, word):
+        """Return the id of word, adding it to the intern table if needed."""
+        try:
+            return self._wordIds[word]
+        except KeyError:
+            wordId = len(self._wordList)
+            self._wordIds[word] = wordId
+            self._wordList.append(word)
+            return wordId
+
+    def _compact(self):
+        """Convert the dict tree in self._root into the flat arrays."""
+        if self._root is None:
+            return
+        edgeStart = array('I', [0])
+        edgeLabels = array('I')
+        edgeTargets = array('I')
+        nodeTemplates = array('i')
+        templates = []
+        # Number the nodes breadth-first, so that the edges of each node
+        # are appended to the edge tables in node order.
+        queue = [self._root]
+        n = 0
+        while n < len(queue):
+            node = queue[n]
+            n += 1
+            if self._TEMPLATE in node:
+                nodeTemplates.append(len(templates))
+                templates.append(node[self._TEMPLATE])
+            else:
+                nodeTemplates.append(-1)
+            edges = []
+            for key, child in node.items():
+                if key == self._TEMPLATE:
+                    continue
+                if not isinstance(key, int):
+                    key = self._intern(key)
+                edges.append((key, child))
+            edges.sort(key=lambda edge: edge[0])
+            for key, child in edges:
+                edgeLabels.append(key)
+                edgeTargets.append(len(queue))
+                queue.append(child)
+            edgeStart.append(len(edgeLabels))
+        self._edgeStart = edgeStart
+        self._edgeLabels = edgeLabels
+        self._edgeTargets = edgeTargets
+        self._nodeTemplates = nodeTemplates
+        self._templates = templates
+        self._root = None
+        self._forgetStats()
+
+    def _toDict(self):
+        """Return the node tree as nested dicts."""
+        if self._root is not None:
+            return self._root
+        nodes = [{} for i in range(len(self._nodeTemplates))]
+        for n, node in enumerate(nodes):
+            t = self._nodeTemplates[n]
+            if t >= 0:
+                node[self._TEMPLATE] = self._templates[t]
+            for i in range(self._edgeStart[n], self._edgeStart[n+1]):
+                key = self._edgeLabels[i]
+                if key >= self._FIRST_WORD_ID:
+                    key = self._wordList[key]
+                node[key] = nodes[self._edgeTargets[i]]
+        return nodes[0]
+
+    def _thaw(self):
+        """Expand the flat arrays back into a dict tree in self._root."""
+        if self._root is not None:
+            return
+        self._root = self._toDict()
+        self._forgetStats()
+        self._edgeStart = array('I', [0, 0])
+        self._edgeLabels = array('I')
+        self._edgeTargets = array('I')
+        self._nodeTemplates = array('i', [-1])
+        self._templates = []
+
+    def _matchRoot(self):
+        self._compact()
+        return 0
+
+    def _child(self, node, key):
+        edgeStart = self._edgeStart
+        lo = edgeStart[node]
+        hi = edgeStart[node+1]
+        labels = self._edgeLabels
+        i = bisect_left(labels, key, lo, hi)
+        if i < hi and labels[i] == key:
+            return self._edgeTargets[i]
+        return None
+
+    def _edges(self, node):
+        labels = self._edgeLabels
+        targets = self._edgeTargets
+        return [(labels[i], targets[i])
+                for i in range(self._edgeStart[node], self._edgeStart[node+1])]
+
+    # the nodes are numbered
+    _statKey = staticmethod(int)
+
+    def _template(self, node):
+        t = self._nodeTemplates[node]
+        if t < 0:
+            return None
+        return self._templates[t]
+
+    def _keys(self, words):
+        # Words that were never interned can't match any edge.
+        get = self._wordIds.get
+        return [get(word, -1) for word in words]
+
+    def _botKey(self):
+        return self._intern(self._botName)
+
+    def _pathWords(self, path):
+        wordList = self._wordList
+        return [key if key < self._FIRST_WORD_ID else wordList[key] for key in path]
@@ -5,6 +5,8 @@ from __future__ import print_function
 
 import copy
 import glob
+import marshal
+import multiprocessing
 import os
 import random
 import re
@@ -13,7 +15,7 @@ import sys
 import time
 import threading
 import xml.sax
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 try:
     from ConfigParser import ConfigParser
 except ImportError:
@@ -22,8 +24,11 @@ except ImportError:
 from .constants import *
 from . import DefaultSubs
 from . import Utils
+from . import BrainFile
 from .AimlParser import create_parser
+from .CompactPatternMgr import CompactPatternMgr
 from .PatternMgr import PatternMgr
+from .TemplateCompiler import TemplateCompiler
 from .WordSub import WordSub
 
 
@@ -42,6 +47,32 @@ def msg_encoder(encoding=None):
                      lambda x: x.decode(encoding, 'replace'))
 
 
+def _parseAiml(args):
+    """Parse an AIML file.  args is (filename, text encoding).
+
+    Returns (filename, categories, error, seconds): the list of
+    (pattern, that, topic) key and template pairs of the file, in
+    order, or None and the message of the parse error.  This runs in
+    the worker processes of Kernel.learnFiles(), so the templates are
+    returned marshal()ed, as the brain stores them: that is done in
+    parallel too, and gives the same bytes as in a single process.
+    Kernel.learn() calls it directly.
+    """
+    filename, encoding = args
+    start = time.time()
+    categories = []
+    parser = create_parser()
+    handler = parser.getContentHandler()
+    handler.setEncoding(encoding)
+    # marshal each template as soon as it is parsed, rather than
+    # keeping the element trees of the whole file
+    handler.setCategoryHandler(lambda key, tem: categories.append((key, marshal.dumps(tem))))
+    try: parser.parse(filename)
+    except xml.sax.SAXParseException as msg:
+        return filename, None, str(msg), time.time() - start
+    return filename, categories, None, time.time() - start
+
+
 
 
 class Kernel:
@@ -49,18 +80,85 @@ class Kernel:
     _globalSessionID = "_global" # key of the global session (duh)
     _maxHistorySize = 10 # maximum length of the _inputs and _responses lists
     _maxRecursionDepth = 100 # maximum number of recursive <srai>/<sr> tags before the response is aborted.
+    _systemTimeout = 30 # seconds a <system> command may run in a response from respond_async()
     # special predicate keys
     _inputHistory = "_inputHistory"     # keys to a queue (list) of recent user input
     _outputHistory = "_outputHistory"   # keys to a queue (list) of recent responses.
     _inputStack = "_inputStack"         # Should always be empty in between calls to respond()
+    _matchStack = "_matchStack"         # Matches being processed; also empty in between calls to respond()
+    _cacheable = "_cacheable"           # False once a non-deterministic template is used by the current response
+    _context = "_context"               # 'that' and topic, as last normalized by _normalizeContext()
+    # predicate keys left out by getSessionData(): the Kernel's own
+    # bookkeeping rather than data of the session
+    _internalKeys = frozenset([_matchStack, _cacheable, _context])
+
+    # Elements whose output depends only on the input, 'that' and topic,
+    # the bot predicates, the substitutions and the brain.  A response
+    # built from templates containing nothing else can be cached until
+    # one of those changes.
+    _deterministicElements = frozenset([
+        "bot", "formal", "gender", "li", "lowercase", "person", "person2",
+        "sentence", "size", "sr", "srai", "star", "template", "text",
+        "thatstar", "think", "topicstar", "uppercase", "version"])
+    _deterministicCacheSize = 4096 # number of templates whose analysis is remembered
+
+    CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+    BatchResponse = namedtuple('BatchResponse', ['response', 'seconds'])
+
+    def __init__(self, compactBrain=False, compileTemplates=False, concurrent=False):
+        """Create a Kernel.
+
+        If `compactBrain` is true, the brain is stored in flat arrays
+        (see CompactPatternMgr) instead of nested dictionaries.  This
+        uses much less memory for large brains, at the cost of slower
+        learning.
+
+        If `compileTemplates` is true, each template is compiled into
+        Python closures the first time it is used (see
+        TemplateCompiler) instead of being interpreted element by
+        element on every response.  The responses are the same either
+        way.
+
+        If `concurrent` is true, respond() only locks the session it is
+        answering, so that different sessions can be answered by
+        different threads at the same time.  The brain is then only
+        read while responding; learn(), loadBrain(), loadSubs() and
+        setBotPredicate() wait until no response is being computed.
+        Otherwise a single lock serializes all calls to respond().
 
-    def __init__(self):
+        """
+        self._compactBrain = compactBrain
+        self._compileTemplates = compileTemplates
+
+        # set up the locks
+        self._concurrent = concurrent
+        self._respondLock = threading.RLock()
+        self._brainLock = Utils.ReadWriteLock() # held for writing while the brain is modified
+        self._sessionsLock = threading.Lock()
+        self._sessionLocks = {}
+        self._local = threading.local()         # the respond_async() request of each thread
+        self._cacheLock = threading.Lock()
+
+        with self._brainLock.writing():
+            self._resetState()
+
+    def _resetState(self):
+        """Set up everything but the locks as in a new Kernel.  The
+        brain must be locked for writing."""
         self._verboseMode = True
         self._version = "python-aiml {}".format(VERSION)
-        self._brain = PatternMgr()
-        self._respondLock = threading.RLock()
+        self._compiler = TemplateCompiler(self) if self._compileTemplates else None
+        self._brain = CompactPatternMgr() if self._compactBrain else PatternMgr()
+        self._brainFrozen = False               # see _freezeBrain()
         self.setTextEncoding(None if PY3 else "utf-8")
 
+        # set up the response cache
+        self._responseCache = OrderedDict()
+        self._responseCacheSize = 0     # off until setResponseCacheSize()
+        self._responseCacheHits = 0
+        self._responseCacheMisses = 0
+        self._deterministic = OrderedDict()
+
         # set up the sessions
         self._sessions = {}
         self._addSession(self._globalSessionID)
@@ -75,6 +173,7 @@ class Kernel:
         self._subbers['person'] = WordSub(DefaultSubs.defaultPerson)
         self._subbers['person2'] = WordSub(DefaultSubs.defaultPerson2)
         self._subbers['normal'] = WordSub(DefaultSubs.defaultNormal)
+        self._subbersVersion = 0 # changes whenever the subbers do
 
         # set up the element processors
         self._elementProcessors = {
@@ -179,28 +278,49 @@ class Kernel:
             kern = aiml.Kernel()
 
         """
-        del(self._brain)
-        self.__init__()
+        with self._brainLock.writing():
+            # keep the locks, which other threads may be waiting for
+            del(self._brain)
+            self._resetState()
 
     def loadBrain(self, filename):
         """Attempt to load a previously-saved 'brain' from the
         specified filename.
 
+        The file may be in either the format written by saveBrain() or
+        the memory-mapped format written by saveBrain(mapped=True); in
+        the latter case the brain is switched to compact storage.
+
         NOTE: the current contents of the 'brain' will be discarded!
 
         """
         if self._verboseMode: print( "Loading brain from %s..." % filename, end="" )
         start = time.time()
-        self._brain.restore(filename)
+        with self._brainLock.writing():
+            if BrainFile.isBrainFile(filename) and not isinstance(self._brain, CompactPatternMgr):
+                self._brain = CompactPatternMgr()
+            self._brain.restore(filename)
+            self._brainFrozen = False
+            self._clearResponseCache()
         if self._verboseMode:
             end = time.time() - start
             print( "done (%d categories in %.2f seconds)" % (self._brain.numTemplates(), end) )
 
-    def saveBrain(self, filename):
-        """Dump the contents of the bot's brain to a file on disk."""
+    def saveBrain(self, filename, mapped=False):
+        """Dump the contents of the bot's brain to a file on disk.
+
+        If `mapped` is true, the brain is written in the BrainFile format,
+        which loadBrain() can memory-map instead of unpickling.
+
+        """
         if self._verboseMode: print( "Saving brain to %s..." % filename, end="")
         start = time.time()
-        self._brain.save(filename)
+        if not mapped:
+            self._brain.save(filename)
+        elif isinstance(self._brain, CompactPatternMgr):
+            self._brain.saveMapped(filename)
+        else:
+            CompactPatternMgr.fromPatternMgr(self._brain).saveMapped(filename)
         if self._verboseMode:
             print("done (%.2f seconds)" % (time.time() - start))
 
@@ -242,11 +362,14 @@ class Kernel:
         If name is not a valid bot predicate, it will be created.
 
         """
-        self._botPredicates[name] = value
-        # Clumsy hack: if updating the bot name, we must update the
-        # name in the brain as well
-        if name == "name":
-            self._brain.setBotName(self.getBotPredicate("name"))
+        with self._brainLock.writing():
+            self._botPredicates[name] = value
+            self._clearResponseCache()
+            # Clumsy hack: if updating the bot name, we must update the
+            # name in the brain as well
+            if name == "name":
+                self._brain.setBotName(self.getBotPredicate("name"))
+                self._brainFrozen = False
 
     def setTextEncoding(self, encoding):
         """
@@ -273,32 +396,91 @@ class Kernel:
         parser = ConfigParser()
         with open(filename) as inFile:
             parser.readfp(inFile, filename)
-        for s in parser.sections():
-            # Add a new WordSub instance for this section.  If one already
-            # exists, delete it.
-            if s in self._subbers:
-                del(self._subbers[s])
-            self._subbers[s] = WordSub()
-            # iterate over the key,value pairs and add them to the subber
-            for k, v in parser.items(s):
-                self._subbers[s][k] = v
+        with self._brainLock.writing():
+            for s in parser.sections():
+                # Add a new WordSub instance for this section.  If one already
+                # exists, delete it.
+                if s in self._subbers:
+                    del(self._subbers[s])
+                self._subbers[s] = WordSub()
+                # iterate over the key,value pairs and add them to the subber
+                for k, v in parser.items(s):
+                    self._subbers[s][k] = v
+            self._subbersVersion += 1
+            self._clearResponseCache()
+
+    def setResponseCacheSize(self, size):
+        """Set the number of responses kept in the response cache.
+
+        Responses built only from deterministic templates (see
+        _deterministicElements) are cached, keyed on the normalised
+        input, 'that' and topic, and served by respond() without
+        matching or processing any template.  A size of 0, the
+        default, disables the cache.
+
+        A cached response is only correct as long as the templates'
+        elements are processed by the Kernel's own handlers and bot
+        predicates are only changed with setBotPredicate().
+
+        """
+        with self._cacheLock:
+            self._responseCacheSize = size
+            while len(self._responseCache) > size:
+                self._responseCache.popitem(last=False)
+
+    def responseCacheInfo(self):
+        """Return the hits, misses, maximum size and current size of
+        the response cache, as a Kernel.CacheInfo named tuple.
+
+        """
+        with self._cacheLock:
+            return self.CacheInfo(self._responseCacheHits, self._responseCacheMisses,
+                                  self._responseCacheSize, len(self._responseCache))
+
+    def _clearResponseCache(self):
+        with self._cacheLock:
+            self._responseCache.clear()
 
     def _addSession(self, sessionID):
         """Create a new session with the specified ID string."""
         if sessionID in self._sessions:
             return
-        # Create the session.
-        self._sessions[sessionID] = {
-            # Initialize the special reserved predicates
-            self._inputHistory: [],
-            self._outputHistory: [],
-            self._inputStack: []
-        }
+        with self._sessionsLock:
+            if sessionID in self._sessions:
+                return
+            # Create the session.
+            self._sessions[sessionID] = {
+                # Initialize the special reserved predicates
+                self._inputHistory: [],
+                self._outputHistory: [],
+                self._inputStack: [],
+                self._matchStack: [],
+                self._cacheable: True
+            }
 
     def _deleteSession(self, sessionID):
         """Delete the specified session."""
-        if sessionID in self._sessions:
-            self._sessions.pop(sessionID)
+        with self._sessionsLock:
+            self._sessions.pop(sessionID, None)
+            self._sessionLocks.pop(sessionID, None)
+
+    def _sessionLock(self, sessionID):
+        """Return the lock serializing responses in the specified
+        session, in concurrent mode."""
+        try:
+            return self._sessionLocks[sessionID]
+        except KeyError:
+            with self._sessionsLock:
+                return self._sessionLocks.setdefault(sessionID, threading.RLock())
+
+    def _freezeBrain(self):
+        """Make sure matching won't modify the brain (see
+        PatternMgr.freeze()), so that it can be shared by concurrent
+        responses."""
+        with self._brainLock.writing():
+            if not self._brainFrozen:
+                self._brain.freeze()
+                self._brainFrozen = True
 
     def getSessionData(self, sessionID=None):
         """Return a copy of the session data dictionary for the
@@ -307,13 +489,17 @@ class Kernel:
         If no sessionID is specified, return a dictionary containing
         *all* of the individual session dictionaries.
 
+        The Kernel's internal keys (_internalKeys) are left out.
+
         """
+        def public(session):
+            return dict((k, v) for k, v in session.items() if k not in self._internalKeys)
         s = None
         if sessionID is not None:
-            try: s = self._sessions[sessionID]
+            try: s = public(self._sessions[sessionID])
             except KeyError: s = {}
         else:
-            s = self._sessions
+            s = dict((k, public(v)) for k, v in self._sessions.items())
         return copy.deepcopy(s)
 
     def learn(self, filename):
@@ -322,26 +508,96 @@ class Kernel:
         If filename includes wildcard characters, all matching files
         will be loaded and learned.
 
+        Each file is parsed completely before its categories are
+        learned, so a file with a fatal parse error is not learned at
+        all, as in learnFiles().  The templates are kept marshal()ed
+        while the file is parsed, as the brain stores them.
+
         """
         for f in glob.glob(filename):
             if self._verboseMode: print( "Loading %s..." % f, end="")
             start = time.time()
             # Load and parse the AIML file.
-            parser = create_parser()
-            handler = parser.getContentHandler()
-            handler.setEncoding(self._textEncoding)
-            try: parser.parse(f)
-            except xml.sax.SAXParseException as msg:
-                err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f,msg)
-                sys.stderr.write(err)
+            f, categories, err, seconds = _parseAiml((f, self._textEncoding))
+            if categories is None:
+                sys.stderr.write("\nFATAL PARSE ERROR in file %s:\n%s\n" % (f, err))
                 continue
-            # store the pattern/template pairs in the PatternMgr.
-            for key, tem in handler.categories.items():
-                self._brain.add(key, tem)
             # Parsing was successful.
+            self.learnCategories(categories)
             if self._verboseMode:
                 print("done (%.2f seconds)" % (time.time() - start))
 
+    def learnFiles(self, filenames, workers=None, progress=None):
+        """Load and learn the AIML files in the list filenames,
+        parsing them in parallel.
+
+        The files are parsed by `workers` processes (by default, one
+        per CPU), and their categories are learned in the order of
+        filenames, so that a category defined by several files ends up
+        as learn() called on each file in turn would leave it.
+
+        If `progress` is given, it is called with (filename, number of
+        files learned, number of files, seconds spent parsing the file)
+        after each file is learned.
+
+        """
+        for done, (f, categories, err, seconds) in enumerate(self.parseFiles(filenames, workers), 1):
+            if categories is None:
+                sys.stderr.write("\nFATAL PARSE ERROR in file %s:\n%s\n" % (f, err))
+            else:
+                self.learnCategories(categories)
+            if progress is not None:
+                progress(f, done, len(filenames), seconds)
+
+    def parseFiles(self, filenames, workers=None):
+        """Parse the AIML files in the list filenames, in `workers`
+        processes (by default, one per CPU), without learning them.
+
+        Yields a tuple (filename, categories, error, seconds) for each
+        file, in the order of filenames: categories is the list of
+        ((pattern, that, topic), template) pairs defined by the file,
+        to be passed to learnCategories(), or None and error the
+        message of the parse error.
+
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        jobs = [(f, self._textEncoding) for f in filenames]
+        if workers <= 1 or len(jobs) <= 1:
+            for job in jobs:
+                yield _parseAiml(job)
+            return
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        try:
+            for result in pool.imap(_parseAiml, jobs):
+                yield result
+        finally:
+            # every file has been parsed, unless a parser raised or
+            # the caller stopped early
+            pool.terminate()
+            pool.join()
+
+    def learnCategories(self, categories):
+        """Learn a list of ((pattern, that, topic), template) pairs, as
+        returned by parseFiles()."""
+        with self._brainLock.writing():
+            for key, tem in categories:
+                self._brain.add(key, tem)
+            self._brainFrozen = False
+            self._clearResponseCache()
+
+    def unlearn(self, keys):
+        """Forget the categories with the given (pattern, that, topic)
+        keys.  Returns the number of categories forgotten."""
+        count = 0
+        with self._brainLock.writing():
+            for key in keys:
+                if self._brain.remove(key):
+                    count += 1
+            self._brainFrozen = False
+            self._clearResponseCache()
+        return count
+
     def respond(self, input_, sessionID=_globalSessionID):
         """Return the Kernel's response to the input string."""
         if len(input_) == 0:
@@ -354,58 +610,213 @@ class Kernel:
         except AttributeError: pass
 
         # prevent other threads from stomping all over us.
-        self._respondLock.acquire()
+        if self._concurrent:
+            # Lock only this session, and share the brain with the
+            # other ones.  The session is locked first: a <learn> in
+            # it waits for the brain's readers to leave, so none of
+            # them may be waiting for the session.
+            lock = self._sessionLock(sessionID)
+            lock.acquire()
+            try:
+                self._acquireBrain()
+            except:
+                lock.release()
+                raise
+        else:
+            lock = self._respondLock
+            lock.acquire()
 
         try:
             # Add the session, if it doesn't already exist
             self._addSession(sessionID)
 
-            # split the input into discrete sentences
-            sentences = Utils.sentences(input_)
-            finalResponse = u""
-            for s in sentences:
-                # Add the input to the history list before fetching the
-                # response, so that <input/> tags work properly.
-                inputHistory = self.getPredicate(self._inputHistory, sessionID)
-                inputHistory.append(s)
-                while len(inputHistory) > self._maxHistorySize:
-                    inputHistory.pop(0)
+            # split the input into discrete sentences, and respond to them
+            finalResponse = self._respondSentences(Utils.sentences(input_), sessionID)
+
+            # and return, encoding the string into the I/O encoding
+            return self._cod.enc(finalResponse)
+
+        finally:
+            # release the locks
+            if self._concurrent:
+                self._brainLock.releaseRead()
+            lock.release()
+
+    def respond_batch(self, inputs, sessionIDs=None):
+        """Return the Kernel's responses to a list of input strings.
+
+        `sessionIDs` lists the session of each input; by default, they
+        are all sent to the global session.  The result is a list of
+        Kernel.BatchResponse named tuples, holding the response to each
+        input and the number of seconds it took, in the order of
+        `inputs`.
+
+        Each distinct sentence is normalized once, and the inputs of each
+        session are answered one after the other, in order, so the
+        responses are those respond() would give if the sessions were
+        sent their inputs one at a time.  Locks are taken once per
+        batch (or, in concurrent mode, once per session) instead of
+        once per input.
+
+        """
+        if sessionIDs is None:
+            sessionIDs = [self._globalSessionID] * len(inputs)
+        elif len(sessionIDs) != len(inputs):
+            raise ValueError("inputs and sessionIDs must have the same length")
+
+        # decode the inputs and split them into sentences.
+        sentenceLists = []
+        for input_ in inputs:
+            try: input_ = self._cod.dec(input_)
+            except UnicodeError: pass
+            except AttributeError: pass
+            sentenceLists.append(Utils.sentences(input_) if len(input_) else [])
+
+        # group the inputs by session, keeping their order.
+        sessions = OrderedDict()
+        for i, sessionID in enumerate(sessionIDs):
+            sessions.setdefault(sessionID, []).append(i)
+
+        results = [None] * len(inputs)
+        if self._concurrent:
+            self._acquireBrain()
+        else:
+            self._respondLock.acquire()
+        try:
+            # run the sentences through the 'normal' subber up front,
+            # once for each distinct sentence.
+            subber = self._subbers['normal']
+            normalized = {}
+            for sentences in sentenceLists:
+                for s in sentences:
+                    if s not in normalized:
+                        normalized[s] = subber.sub(s)
+        finally:
+            if self._concurrent:
+                # as in respond(), sessions are locked before the brain
+                self._brainLock.releaseRead()
+
+        try:
+            for sessionID, indexes in sessions.items():
+                if self._concurrent:
+                    lock = self._sessionLock(sessionID)
+                    lock.acquire()
+                    try:
+                        self._acquireBrain()
+                    except:
+                        lock.release()
+                        raise
+                try:
+                    self._addSession(sessionID)
+                    for i in indexes:
+                        start = time.time()
+                        response = u""
+                        if sentenceLists[i]:
+                            response = self._respondSentences(sentenceLists[i], sessionID, normalized)
+                        results[i] = self.BatchResponse(self._cod.enc(response), time.time() - start)
+                finally:
+                    if self._concurrent:
+                        self._brainLock.releaseRead()
+                        lock.release()
+        finally:
+            if not self._concurrent:
+                self._respondLock.release()
+        return results
+
+    def _acquireBrain(self):
+        """Take the brain's read lock, in concurrent mode, freezing the
+        brain first if it has been modified."""
+        self._brainLock.acquireRead()
+        while not self._brainFrozen:
+            self._brainLock.releaseRead()
+            self._freezeBrain()
+            self._brainLock.acquireRead()
+
+    def _respondSentences(self, sentences, sessionID, normalized=None):
+        """Return the response to the list of sentences, recording them
+        in the session's history.  The session must be locked.
+
+        `normalized` optionally maps sentences to their output from the
+        'normal' subber.
+
+        """
+        finalResponse = u""
+        for s in sentences:
+            # Add the input to the history list before fetching the
+            # response, so that <input/> tags work properly.
+            inputHistory = self.getPredicate(self._inputHistory, sessionID)
+            inputHistory.append(s)
+            while len(inputHistory) > self._maxHistorySize:
+                inputHistory.pop(0)
+            self.setPredicate(self._inputHistory, inputHistory, sessionID)
+
+            # Fetch the response
+            try:
+                response = self._respond(s, sessionID,
+                                         normalized[s] if normalized is not None else None)
+            except BaseException:
+                # The response was abandoned (e.g. a cancelled
+                # respond_async()): leave the session as if this
+                # input had never been sent.
+                inputHistory.pop()
                 self.setPredicate(self._inputHistory, inputHistory, sessionID)
+                self.setPredicate(self._inputStack, [], sessionID)
+                self.setPredicate(self._matchStack, [], sessionID)
+                raise
 
-                # Fetch the response
-                response = self._respond(s, sessionID)
+            # add the data from this exchange to the history lists
+            outputHistory = self.getPredicate(self._outputHistory, sessionID)
+            outputHistory.append(response)
+            while len(outputHistory) > self._maxHistorySize:
+                outputHistory.pop(0)
+            self.setPredicate(self._outputHistory, outputHistory, sessionID)
 
-                # add the data from this exchange to the history lists
-                outputHistory = self.getPredicate(self._outputHistory, sessionID)
-                outputHistory.append(response)
-                while len(outputHistory) > self._maxHistorySize:
-                    outputHistory.pop(0)
-                self.setPredicate(self._outputHistory, outputHistory, sessionID)
+            # append this response to the final response.
+            finalResponse += (response + u"  ")
 
-                # append this response to the final response.
-                finalResponse += (response + u"  ")
+        #print( "@ASSERT", self.getPredicate(self._inputStack, sessionID))
+        assert(len(self.getPredicate(self._inputStack, sessionID)) == 0)
+        return finalResponse.strip()
 
-            finalResponse = finalResponse.strip()
-            #print( "@ASSERT", self.getPredicate(self._inputStack, sessionID))
-            assert(len(self.getPredicate(self._inputStack, sessionID)) == 0)
+    def respond_async(self, input_, sessionID=_globalSessionID, executor=None, systemTimeout=None):
+        """Return a coroutine computing the Kernel's response to the
+        input string, for use with asyncio:
 
-            # and return, encoding the string into the I/O encoding
-            return self._cod.enc(finalResponse)
+            response = await kernel.respond_async("hello", "user1")
 
-        finally:
-            # release the lock
-            self._respondLock.release()
+        The matching runs in `executor` (by default, the event loop's
+        default executor), and <system> elements run as asyncio
+        subprocesses, killed after `systemTimeout` seconds (by default,
+        _systemTimeout).  Cancelling the coroutine kills the running
+        <system> command, abandons the response at the next <srai> and
+        leaves the session as it was.  Requires Python 3.7 or later.
+
+        """
+        from .AsyncKernel import respond
+        if systemTimeout is None:
+            systemTimeout = self._systemTimeout
+        return respond(self, input_, sessionID, executor, systemTimeout)
 
 
     # This version of _respond() just fetches the response for some input.
     # It does not mess with the input and output histories.  Recursive calls
     # to respond() spawned from tags like <srai> should call this function
     # instead of respond().
-    def _respond(self, input_, sessionID):
-        """Private version of respond(), does the real work."""
+    def _respond(self, input_, sessionID, subbedInput=None):
+        """Private version of respond(), does the real work.
+
+        `subbedInput` is input_ already run through the 'normal'
+        subber, if the caller has it.
+
+        """
         if len(input_) == 0:
             return u""
 
+        # give up if this is a cancelled respond_async() request.
+        request = getattr(self._local, "request", None)
+        if request is not None:
+            request.check()
+
         # guard against infinite recursion
         inputStack = self.getPredicate(self._inputStack, sessionID)
         if len(inputStack) > self._maxRecursionDepth:
@@ -420,32 +831,64 @@ class Kernel:
         self.setPredicate(self._inputStack, inputStack, sessionID)
 
         # run the input through the 'normal' subber
-        subbedInput = self._subbers['normal'].sub(input_)
+        if subbedInput is None:
+            subbedInput = self._subbers['normal'].sub(input_)
 
         # fetch the bot's previous response, to pass to the match()
-        # function as 'that'.
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = outputHistory[-1]
-        except IndexError: that = ""
-        subbedThat = self._subbers['normal'].sub(that)
-
-        # fetch the current topic
-        topic = self.getPredicate("topic", sessionID)
-        subbedTopic = self._subbers['normal'].sub(topic)
+        # function as 'that', and the current topic.
+        subbedThat, subbedTopic, context = self._normalizeContext(sessionID)
+
+        # Serve the response from the cache, if this is not a recursive
+        # call and the same input has already been answered using only
+        # deterministic templates.
+        cacheKey = None
+        if len(inputStack) == 1 and self._responseCacheSize > 0:
+            cacheKey = (subbedInput, subbedThat, subbedTopic)
+            with self._cacheLock:
+                response = self._responseCache.pop(cacheKey, None)
+                if response is None:
+                    self._responseCacheMisses += 1
+                else:
+                    self._responseCacheHits += 1
+                    self._responseCache[cacheKey] = response
+            if response is not None:
+                inputStack.pop()
+                self.setPredicate(self._inputStack, inputStack, sessionID)
+                return response
+            self.setPredicate(self._cacheable, True, sessionID)
 
         # Determine the final response.
         response = u""
-        elem = self._brain.match(subbedInput, subbedThat, subbedTopic)
-        if elem is None:
+        match = self._brain.match(subbedInput, subbedThat, subbedTopic, context)
+        if match is None:
             if self._verboseMode:
                 err = "WARNING: No match found for input: %s\n" % self._cod.enc(input_)
                 sys.stderr.write(err)
         else:
-            # Process the element into a response string.
-            response += self._processElement(elem, sessionID).strip()
+            # Push the match, so that <star/> and friends can read the
+            # text captured by its wildcards, and process its template
+            # into a response string.
+            matchStack = self.getPredicate(self._matchStack, sessionID)
+            matchStack.append(match)
+            self.setPredicate(self._matchStack, matchStack, sessionID)
+            if self._responseCacheSize > 0 and not self._isDeterministic(match):
+                self.setPredicate(self._cacheable, False, sessionID)
+            if self._compiler is not None:
+                response += self._compiler.run(match, sessionID).strip()
+            else:
+                response += self._processElement(match.template, sessionID).strip()
             response += u" "
+            matchStack = self.getPredicate(self._matchStack, sessionID)
+            matchStack.pop()
+            self.setPredicate(self._matchStack, matchStack, sessionID)
         response = response.strip()
 
+        if cacheKey is not None and self.getPredicate(self._cacheable, sessionID):
+            with self._cacheLock:
+                self._responseCache[cacheKey] = response
+                if len(self._responseCache) > self._responseCacheSize:
+                    self._responseCache.popitem(last=False)
+
         # pop the top entry off the input stack.
         inputStack = self.getPredicate(self._inputStack, sessionID)
         inputStack.pop()
@@ -453,6 +896,60 @@ class Kernel:
 
         return response
 
+    def _normalizeContext(self, sessionID):
+        """Return the session's 'that' (the bot's previous response) and
+        topic, run through the 'normal' subber, and the context the
+        brain matches them as (see PatternMgr.normalizeContext()).
+
+        They are the same for every <srai> of a response, and often
+        from one response to the next, so the session keeps the last
+        result until the output history, the topic or the subbers
+        change.
+
+        """
+        outputHistory = self.getPredicate(self._outputHistory, sessionID)
+        try: that = outputHistory[-1]
+        except IndexError: that = ""
+        topic = self.getPredicate("topic", sessionID)
+        cached = self.getPredicate(self._context, sessionID)
+        if (cached and cached[0] == that and cached[1] == topic and
+            cached[2] == self._subbersVersion):
+            return cached[3:]
+        subbedThat = self._subbers['normal'].sub(that)
+        subbedTopic = self._subbers['normal'].sub(topic)
+        context = self._brain.normalizeContext(subbedThat, subbedTopic)
+        self.setPredicate(self._context, (that, topic, self._subbersVersion,
+                                          subbedThat, subbedTopic, context), sessionID)
+        return subbedThat, subbedTopic, context
+
+    def _isDeterministic(self, match):
+        """Return True if the template selected by match contains only
+        _deterministicElements, handled by the Kernel's own handlers.
+
+        The result is remembered for each template, so every template
+        is analysed only once while it is in use.
+
+        """
+        cache = self._deterministic
+        with self._cacheLock:
+            deterministic = cache.pop(match.data, None)
+        if deterministic is None:
+            deterministic = True
+            stack = [match.template]
+            while stack and deterministic:
+                elem = stack.pop()
+                tag = elem[0]
+                if (tag not in self._deterministicElements or
+                    self._elementProcessors.get(tag) != getattr(self, "_process" + tag.capitalize())):
+                    deterministic = False
+                elif tag != "text":
+                    stack.extend(elem[2:])
+        with self._cacheLock:
+            cache[match.data] = deterministic
+            if len(cache) > self._deterministicCacheSize:
+                cache.popitem(last=False)
+        return deterministic
+
     def _processElement(self, elem, sessionID):
         """Process an AIML element.
 
@@ -719,7 +1216,12 @@ class Kernel:
         filename = ""
         for e in elem[2:]:
             filename += self._processElement(e, sessionID)
-        self.learn(filename)
+        with self._brainLock.writing():
+            self.learn(filename)
+            if self._concurrent:
+                # other sessions will resume matching as soon as the
+                # lock is released.
+                self._freezeBrain()
         return ""
 
     # <li>
@@ -909,16 +1411,9 @@ class Kernel:
         """
         try: index = int(elem[1]['index'])
         except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("star", input_, that, topic, index)
-        return response
+        # fetch the captures of the match currently being processed
+        matchStack = self.getPredicate(self._matchStack, sessionID)
+        return matchStack[-1].star("star", index)
 
     # <system>
     def _processSystem(self, elem, sessionID):
@@ -949,15 +1444,22 @@ class Kernel:
         command = os.path.normpath(command)
 
         # execute the command.
+        # Within respond_async(), the command runs as an asyncio
+        # subprocess, which can time out or be cancelled.
         response = ""
+        request = getattr(self._local, "request", None)
         try:
-            out = os.popen(command)
+            if request is not None:
+                out = request.system(command)
+            else:
+                out = os.popen(command)
         except RuntimeError as msg:
             if self._verboseMode:
                 err = "WARNING: RuntimeError while processing \"system\" element:\n%s\n" % self._cod.enc(msg)
                 sys.stderr.write(err)
             return "There was an error while computing my response.  Please inform my botmaster."
-        time.sleep(0.01) # I'm told this works around a potential IOError exception.
+        if request is None:
+            time.sleep(0.01) # I'm told this works around a potential IOError exception.
         for line in out:
             response += line + "\n"
         response = ' '.join(response.splitlines()).strip()
@@ -1049,16 +1551,9 @@ class Kernel:
         """
         try: index = int(elem[1]['index'])
         except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except Exception: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("thatstar", input_, that, topic, index)
-        return response
+        # fetch the captures of the match currently being processed
+        matchStack = self.getPredicate(self._matchStack, sessionID)
+        return matchStack[-1].star("thatstar", index)
 
     # <think>
     def _processThink(self, elem, sessionID):
@@ -1090,16 +1585,9 @@ class Kernel:
         """
         try: index = int(elem[1]['index'])
         except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except Exception: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("topicstar", input_, that, topic, index)
-        return response
+        # fetch the captures of the match currently being processed
+        matchStack = self.getPredicate(self._matchStack, sessionID)
+        return matchStack[-1].star("topicstar", index)
 
     # <uppercase>
     def _processUppercase(self, elem, sessionID):
@@ -0,0 +1,237 @@
+'''
+A pool of Kernel worker processes sharing one brain.
+
+A single Kernel answers on one core at a time, whatever its locking,
+because matching runs under the GIL.  KernelPool loads the brain once,
+then fork()s worker processes which inherit it: the brain's pages are
+shared copy-on-write (and, for a memory-mapped brain file, through the
+page cache) instead of being loaded again by every worker.
+
+Each session is always answered by the same worker, so its predicates
+and history stay consistent.  Requests return
+concurrent.futures.Future objects.
+'''
+
+from __future__ import print_function
+
+from concurrent.futures import Future
+import gc
+import itertools
+import multiprocessing
+import threading
+import zlib
+
+from .Kernel import Kernel
+
+
+def _serve(kernel, conn, inherited):
+    """Main loop of a worker process: answer requests from conn until
+    it is closed."""
+    # close our copies of the other workers' pipes, so that they see
+    # EOF when the pool closes them.
+    for c in inherited:
+        c.close()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        batchId, method, calls = request
+        results = []
+        for args in calls:
+            try:
+                results.append((True, getattr(kernel, method)(*args)))
+            except Exception as e:
+                results.append((False, e))
+        try:
+            conn.send((batchId, results))
+        except Exception as e:
+            # an unpicklable exception or result
+            err = RuntimeError("%s: %s" % (e.__class__.__name__, e))
+            conn.send((batchId, [(False, err)] * len(calls)))
+    conn.close()
+
+
+class _Worker(object):
+    """The parent's end of a worker process."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.sendLock = threading.Lock()
+        self.pending = {}   # batch id -> list of Futures
+        self.exited = False # set once the worker has gone away
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def submit(self, batchId, method, calls):
+        futures = [Future() for args in calls]
+        with self.sendLock:
+            if not self.exited:
+                try:
+                    self.conn.send((batchId, method, calls))
+                except (OSError, EOFError):
+                    self.exited = True
+                else:
+                    self.pending[batchId] = futures
+                    return futures
+        self._fail(futures)
+        return futures
+
+    def _fail(self, futures):
+        for future in futures:
+            if not future.done():
+                future.set_exception(RuntimeError("Kernel worker exited"))
+
+    def _read(self):
+        # Resolve the futures of each batch as its results arrive.
+        while True:
+            try:
+                batchId, results = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.sendLock:
+                futures = self.pending.pop(batchId)
+            for future, (ok, value) in zip(futures, results):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        # The worker went away; fail whatever it had not answered.
+        with self.sendLock:
+            pending, self.pending = self.pending, {}
+            self.exited = True
+        for futures in pending.values():
+            self._fail(futures)
+
+
+class KernelPool(object):
+    """A pool of worker processes answering for one Kernel.
+
+    Usage:
+        pool = KernelPool(brainFile="alice.brn", workers=4)
+        print( pool.respond("hello", "user1").result() )
+        pool.close()
+
+    Instead of a brain file, an already prepared Kernel (brain
+    learned, bot predicates set, ...) can be passed as `kernel`.
+    Worker processes are created with fork(), so this only works on
+    platforms that have it, and the pool must be created while no
+    other thread is using the Kernel.
+
+    """
+
+    def __init__(self, brainFile=None, workers=None, kernel=None):
+        if kernel is None:
+            kernel = Kernel()
+            kernel.verbose(False)
+            if brainFile is not None:
+                kernel.loadBrain(brainFile)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self._batchIds = itertools.count()
+        self._workers = []
+        ctx = multiprocessing.get_context("fork")
+        # Move the brain out of the collector's reach, so that garbage
+        # collections in the workers don't write to (and so copy) every
+        # page holding it.
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        # Fork every worker before starting the threads reading their
+        # results, so that no worker is forked from a process whose
+        # other threads may hold a lock.
+        started = []
+        try:
+            for i in range(workers):
+                parentConn, childConn = ctx.Pipe()
+                inherited = [conn for process, conn in started] + [parentConn]
+                process = ctx.Process(target=_serve, args=(kernel, childConn, inherited))
+                process.daemon = True
+                process.start()
+                childConn.close()
+                started.append((process, parentConn))
+        finally:
+            if hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+            self._workers = [_Worker(process, conn) for process, conn in started]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def numWorkers(self):
+        """Return the number of worker processes."""
+        return len(self._workers)
+
+    def _worker(self, sessionID):
+        """Return the worker answering for the specified session."""
+        if not self._workers:
+            raise RuntimeError("KernelPool is closed")
+        # A stable hash, unlike hash() on strings.
+        key = zlib.crc32(str(sessionID).encode("utf-8"))
+        return self._workers[key % len(self._workers)]
+
+    def _call(self, method, *args):
+        sessionID = args[-1]
+        worker = self._worker(sessionID)
+        return worker.submit(next(self._batchIds), method, [args])[0]
+
+    def respond(self, input_, sessionID=Kernel._globalSessionID):
+        """Return a Future for the Kernel's response to the input
+        string in the specified session."""
+        return self._call("respond", input_, sessionID)
+
+    def respond_many(self, inputs, sessionIDs):
+        """Return a list of Futures for the responses to each of
+        `inputs`, in the matching session of `sessionIDs`.
+
+        The inputs are sent to each worker in a single batch, and the
+        inputs of a session are answered in order.
+
+        """
+        if len(inputs) != len(sessionIDs):
+            raise ValueError("inputs and sessionIDs must have the same length")
+        batches = {}
+        for i, (input_, sessionID) in enumerate(zip(inputs, sessionIDs)):
+            worker = self._worker(sessionID)
+            batches.setdefault(worker, []).append((i, (input_, sessionID)))
+        futures = [None] * len(inputs)
+        for worker, items in batches.items():
+            batch = worker.submit(next(self._batchIds), "respond", [args for i, args in items])
+            for (i, args), future in zip(items, batch):
+                futures[i] = future
+        return futures
+
+    def getPredicate(self, name, sessionID=Kernel._globalSessionID):
+        """Return a Future for the value of the predicate in the
+        specified session."""
+        return self._call("getPredicate", name, sessionID)
+
+    def setPredicate(self, name, value, sessionID=Kernel._globalSessionID):
+        """Set the value of the predicate in the specified session.
+
+        Returns a Future, done once the worker has set it.
+
+        """
+        return self._call("setPredicate", name, value, sessionID)
+
+    def close(self):
+        """Stop the worker processes, once they have answered the
+        requests already sent."""
+        for worker in self._workers:
+            with worker.sendLock:
+                try:
+                    worker.conn.send(None)
+                except (OSError, ValueError):
+                    pass
+        for worker in self._workers:
+            worker.process.join()
+            worker.reader.join()
+            worker.conn.close()
+        self._workers = []
@@ -0,0 +1,50 @@
+"""This module implements the Normalizer class, which turns text into
+the words the brain matches against its patterns.
+
+Usage:
+    > normalizer = Normalizer()
+    > print( normalizer.tokens(u"Hello, how're you?") )
+    [('HELLO', 0, 5), ('HOW', 7, 10), ('RE', 11, 13), ('YOU', 14, 17)]
+
+tokens() converts the text to upper case and replaces punctuation with
+spaces in a single str.translate() pass, and returns each word along
+with its offsets in the text as typed, which <star/> and friends slice
+the matched text from.
+"""
+
+from __future__ import print_function
+
+import re
+
+from .constants import *
+
+
+class Normalizer(object):
+    """Splits text into words for pattern matching."""
+
+    # characters replaced by spaces before matching
+    _punctuation = u"""`~!@#$%^&*()-_=+[{]}\\|;:'",<.>/?"""
+
+    def __init__(self):
+        self._table = dict((ord(c), u" ") for c in self._punctuation)
+        # for byte strings, under Python 2
+        self._puncStripRE = re.compile("[" + re.escape(str(self._punctuation)) + "]")
+        self._wordRE = re.compile(r"\S+", re.UNICODE)
+
+    def tokens(self, text):
+        """Return the words text is matched as, upper-cased and with
+        punctuation replaced by spaces, as a list of (word, start, end)
+        tuples where text[start:end] is the word as typed.
+        """
+        if isinstance(text, unicode):
+            upper = text.upper()
+            if len(upper) != len(text):
+                # Some letters, such as u"ß", grow when upper-cased;
+                # find the words in the text as typed instead.
+                return [(m.group().upper(), m.start(), m.end())
+                        for m in self._wordRE.finditer(text.translate(self._table))]
+            stripped = upper.translate(self._table)
+        else:
+            stripped = self._puncStripRE.sub(" ", text.upper())
+        return [(m.group(), m.start(), m.end())
+                for m in self._wordRE.finditer(stripped)]
@@ -6,13 +6,62 @@ http://www.alicebot.org/documentation/matching.html
 
 from __future__ import print_function
 
+from collections import OrderedDict
 import marshal
 import pprint
-import re
-import string
 import sys
+import threading
 
 from .constants import *
+from .Normalizer import Normalizer
+
+class Match(object):
+    """The result of PatternMgr.match().
+
+    Holds the selected template together with the spans of the input,
+    that and topic tokens (see Normalizer.tokens()) captured by each '*'
+    or '_' of the matching category, so that <star/>, <thatstar/> and
+    <topicstar/> can be resolved without matching the input again.
+
+    'data' is the template as stored in the brain; it identifies the
+    template and is only decoded into 'template' when that is read.
+    """
+    _starTypes = {'star': 0, 'thatstar': 1, 'topicstar': 2}
+
+    def __init__(self, data, pattern, inputs, tokens, captures, decode):
+        self.data = data
+        self.pattern = pattern
+        self._inputs = inputs
+        self._tokens = tokens
+        self._captures = captures
+        self._decode = decode
+        self._template = None
+
+    @property
+    def template(self):
+        """The element tree of the selected template."""
+        if self._template is None:
+            self._template = self._decode(self.data)
+        return self._template
+
+    def star(self, starType, index=1):
+        """Return the text captured by the index'th wildcard (counting
+        from 1) of the given starType: 'star', 'thatstar' or 'topicstar'.
+
+        Returns the empty string if there is no such wildcard.
+        """
+        try: which = self._starTypes[starType]
+        except KeyError:
+            raise ValueError( "starType must be in ['star', 'thatstar', 'topicstar']" )
+        spans = self._captures[which]
+        if index < 1 or index > len(spans):
+            return u""
+        start, end = spans[index-1]
+        # extract the star words from the original, unmutilated input.
+        tokens = self._tokens[which]
+        text = self._inputs[which][tokens[start][1]:tokens[end-1][2]]
+        return u' '.join(text.split())
+
 
 class PatternMgr:
     # special dictionary keys
@@ -22,14 +71,30 @@ class PatternMgr:
     _THAT       = 3
     _TOPIC      = 4
     _BOT_NAME   = 5
+
+    # number of decoded templates kept by _decodeTemplate()
+    _templateCacheSize = 256
+
+    # written first by save(), telling its files from those of older
+    # versions, which start with the number of templates and hold them
+    # decoded
+    _FORMAT = u"PyAIML brain 2"
+
+    # whether _match() skips the numbers of words a wildcard could eat
+    # that _wildcardStats() shows cannot lead to a match
+    _pruneWildcards = True
+    # stands for "any number of words" in _wildcardStats()
+    _MANY = sys.maxsize
     
     def __init__(self):
         self._root = {}
         self._templateCount = 0
         self._botName = u"Nameless"
-        punctuation = r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?"""
-        self._puncStripRE = re.compile("[" + re.escape(punctuation) + "]")
-        self._whitespaceRE = re.compile(r"\s+", re.UNICODE)
+        self._templateCache = OrderedDict()
+        self._templateCacheLock = threading.Lock()
+        self._normalizer = Normalizer()
+        self._stats = {}  # see _wildcardStats()
+        self._bounds = {} # see _phaseBounds()
 
     def numTemplates(self):
         """Return the number of templates currently stored."""
@@ -42,6 +107,29 @@ class PatternMgr:
         # Collapse a multi-word name into a single word
         self._botName = unicode( ' '.join(name.split()) )
 
+    def setTemplateCacheSize(self, size):
+        """Set the number of decoded templates to keep in memory.
+
+        Templates are stored marshal()ed and decoded when a match selects
+        them; the most recently used ones are kept decoded.
+        """
+        with self._templateCacheLock:
+            self._templateCacheSize = size
+            while len(self._templateCache) > size:
+                self._templateCache.popitem(last=False)
+
+    def freeze(self):
+        """Finish any work deferred by add() or setBotName(), so that
+        match() does not modify the PatternMgr until they are called
+        again.  This makes it safe to match from several threads at once.
+
+        match() still fills in the statistics of _wildcardStats() for the
+        nodes it visits; every entry is computed from the node tree alone
+        and stored with a single dict assignment, so concurrent matches
+        can share them.
+        """
+        pass
+
     def dump(self):
         """Print all learned patterns, for debugging purposes."""
         pprint.pprint(self._root)
@@ -52,6 +140,7 @@ class PatternMgr:
         """
         try:
             outFile = open(filename, "wb")
+            marshal.dump(self._FORMAT, outFile)
             marshal.dump(self._templateCount, outFile)
             marshal.dump(self._botName, outFile)
             marshal.dump(self._root, outFile)
@@ -61,28 +150,88 @@ class PatternMgr:
             raise
 
     def restore(self, filename):
-        """Restore a previously save()d collection of patterns."""
+        """Restore a previously save()d collection of patterns.
+
+        Brains saved by older versions are converted as they are loaded,
+        which takes longer; save() them again (see brainconvert.py) to
+        avoid it.
+        """
         try:
             inFile = open(filename, "rb")
-            self._templateCount = marshal.load(inFile)
+            header = marshal.load(inFile)
+            encoded = header == self._FORMAT
+            self._templateCount = marshal.load(inFile) if encoded else header
             self._botName = marshal.load(inFile)
             self._root = marshal.load(inFile)
             inFile.close()
         except Exception as e:
             print( "Error restoring PatternMgr from file %s:" % filename )
             raise
+        self._templateCache.clear()
+        self._forgetStats()
+        if encoded:
+            return
+        # Brains saved by older versions hold decoded templates.
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key == self._TEMPLATE:
+                    node[key] = self._encodeTemplate(child)
+                else:
+                    stack.append(child)
 
     def add(self, data, template):
         """Add a [pattern/that/topic] tuple and its corresponding template
         to the node tree.
         """
-        pattern,that,topic = data
-        # TODO: make sure words contains only legal characters
-        # (alphanumerics,*,_)
-
         # Navigate through the node tree to the template's location, adding
         # nodes if necessary.
         node = self._root
+        path = [node]
+        for key in self._nodeKeys(data):
+            if key not in node:
+                node[key] = {}
+            node = node[key]
+            path.append(node)
+        self._forgetStats(path)
+
+        # add the template.
+        if self._TEMPLATE not in node:
+            self._templateCount += 1    
+        node[self._TEMPLATE] = self._encodeTemplate(template)
+
+    def remove(self, data):
+        """Remove the template of a [pattern/that/topic] tuple from the
+        node tree, along with the nodes that only led to it.
+
+        Returns False if there was no such template.
+        """
+        path = []
+        node = self._root
+        for key in self._nodeKeys(data):
+            child = node.get(key)
+            if child is None:
+                return False
+            path.append((node, key))
+            node = child
+        if self._TEMPLATE not in node:
+            return False
+        self._forgetStats([parent for parent, key in path] + [node])
+        del node[self._TEMPLATE]
+        self._templateCount -= 1
+        while path and not node:
+            node, key = path.pop()
+            del node[key]
+        return True
+
+    def _nodeKeys(self, data):
+        """Return the keys of the nodes leading from the root to the
+        template of a [pattern/that/topic] tuple."""
+        pattern,that,topic = data
+        # TODO: make sure words contains only legal characters
+        # (alphanumerics,*,_)
+        keys = []
         for word in pattern.split():
             key = word
             if key == u"_":
@@ -91,50 +240,75 @@ class PatternMgr:
                 key = self._STAR
             elif key == u"BOT_NAME":
                 key = self._BOT_NAME
-            if key not in node:
-                node[key] = {}
-            node = node[key]
+            keys.append(key)
 
-        # navigate further down, if a non-empty "that" pattern was included
+        # continue with the "that" pattern, if a non-empty one was included
         if len(that) > 0:
-            if self._THAT not in node:
-                node[self._THAT] = {}
-            node = node[self._THAT]
+            keys.append(self._THAT)
             for word in that.split():
                 key = word
                 if key == u"_":
                     key = self._UNDERSCORE
                 elif key == u"*":
                     key = self._STAR
-                if key not in node:
-                    node[key] = {}
-                node = node[key]
+                keys.append(key)
 
-        # navigate yet further down, if a non-empty "topic" string was included
+        # and the "topic" string, if a non-empty one was included
         if len(topic) > 0:
-            if self._TOPIC not in node:
-                node[self._TOPIC] = {}
-            node = node[self._TOPIC]
+            keys.append(self._TOPIC)
             for word in topic.split():
                 key = word
                 if key == u"_":
                     key = self._UNDERSCORE
                 elif key == u"*":
                     key = self._STAR
-                if key not in node:
-                    node[key] = {}
-                node = node[key]
+                keys.append(key)
+        return keys
 
+    def _encodeTemplate(self, template):
+        """Return the stored (marshal()ed) form of a template."""
+        if isinstance(template, bytes):
+            return template
+        return marshal.dumps(template)
 
-        # add the template.
-        if self._TEMPLATE not in node:
-            self._templateCount += 1    
-        node[self._TEMPLATE] = template
+    def _decodeTemplate(self, data):
+        """Return the element tree of a stored template.
+
+        Decoded templates are kept in a least-recently-used cache, since
+        the same few categories tend to be matched over and over.
+        """
+        cache = self._templateCache
+        with self._templateCacheLock:
+            template = cache.pop(data, None)
+        if template is None:
+            template = marshal.loads(data)
+        with self._templateCacheLock:
+            cache[data] = template
+            if len(cache) > self._templateCacheSize:
+                cache.popitem(last=False)
+        return template
 
-    def match(self, pattern, that, topic):
-        """Return the template which is the closest match to pattern. The
-        'that' parameter contains the bot's previous response. The 'topic'
-        parameter contains the current topic of conversation.
+    def normalizeContext(self, that, topic):
+        """Return the 'that' and topic passed to match() as it uses
+        them: a tuple (that, topic, thatTokens, topicTokens) of the
+        strings <thatstar/> and <topicstar/> read from, and the
+        Normalizer.tokens() they are matched as.
+
+        The result only depends on 'that' and topic, so a caller
+        matching several inputs against the same ones can compute it
+        once and pass it to match() as 'context'.
+        """
+        if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
+        if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
+        tokens = self._normalizer.tokens
+        return (that, topic, tokens(that), tokens(topic))
+
+    def match(self, pattern, that, topic, context=None):
+        """Return a Match for the template which is the closest match to
+        pattern. The 'that' parameter contains the bot's previous
+        response. The 'topic' parameter contains the current topic of
+        conversation.  'context' is normalizeContext(that, topic), if
+        the caller has it.
 
         Returns None if no template is found.
         """
@@ -142,19 +316,20 @@ class PatternMgr:
             return None
         # Mutilate the input.  Remove all punctuation and convert the
         # text to all caps.
-        input_ = pattern.upper()
-        input_ = re.sub(self._puncStripRE, " ", input_)
-        if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
-        thatInput = that.upper()
-        thatInput = re.sub(self._puncStripRE, " ", thatInput)
-        thatInput = re.sub(self._whitespaceRE, " ", thatInput)
-        if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
-        topicInput = topic.upper()
-        topicInput = re.sub(self._puncStripRE, " ", topicInput)
-        
-        # Pass the input off to the recursive call
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
-        return template
+        tokens = self._normalizer.tokens(pattern)
+        if context is None:
+            context = self.normalizeContext(that, topic)
+        that, topic, thatTokens, topicTokens = context
+        words, thatWords, topicWords = [[token[0] for token in t] for t in
+                                         (tokens, thatTokens, topicTokens)]
+
+        # Pass the input off to the pattern-matcher
+        patMatch, template, captures = self._match(words, thatWords, topicWords, self._matchRoot())
+        if template is None:
+            return None
+        return Match(template, patMatch, (pattern, that, topic),
+                     (tokens, thatTokens, topicTokens), captures,
+                     self._decodeTemplate)
 
     def star(self, starType, pattern, that, topic, index):
         """Returns a string, the portion of pattern that was matched by a *.
@@ -164,97 +339,314 @@ class PatternMgr:
          - 'star': matches a star in the main pattern.
          - 'thatstar': matches a star in the that pattern.
          - 'topicstar': matches a star in the topic pattern.
-        """
-        # Mutilate the input.  Remove all punctuation and convert the
-        # text to all caps.
-        input_ = pattern.upper()
-        input_ = re.sub(self._puncStripRE, " ", input_)
-        input_ = re.sub(self._whitespaceRE, " ", input_)
-        if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
-        thatInput = that.upper()
-        thatInput = re.sub(self._puncStripRE, " ", thatInput)
-        thatInput = re.sub(self._whitespaceRE, " ", thatInput)
-        if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
-        topicInput = topic.upper()
-        topicInput = re.sub(self._puncStripRE, " ", topicInput)
-        topicInput = re.sub(self._whitespaceRE, " ", topicInput)
-
-        # Pass the input off to the recursive pattern-matcher
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
-        if template == None:
-            return ""
 
-        # Extract the appropriate portion of the pattern, based on the
-        # starType argument.
-        words = None
-        if starType == 'star':
-            patMatch = patMatch[:patMatch.index(self._THAT)]
-            words = input_.split()
-        elif starType == 'thatstar':
-            patMatch = patMatch[patMatch.index(self._THAT)+1 : patMatch.index(self._TOPIC)]
-            words = thatInput.split()
-        elif starType == 'topicstar':
-            patMatch = patMatch[patMatch.index(self._TOPIC)+1 :]
-            words = topicInput.split()
-        else:
+        This matches the input again; callers that already hold the
+        Match returned by match() should use Match.star() instead.
+        """
+        if starType not in Match._starTypes:
             # unknown value
             raise ValueError( "starType must be in ['star', 'thatstar', 'topicstar']" )
-        
-        # compare the input string to the matched pattern, word by word.
-        # At the end of this loop, if foundTheRightStar is true, start and
-        # end will contain the start and end indices (in "words") of
-        # the substring that the desired star matched.
-        foundTheRightStar = False
-        start = end = j = numStars = k = 0
-        for i in range(len(words)):
-            # This condition is true after processing a star
-            # that ISN'T the one we're looking for.
-            if i < k:
-                continue
-            # If we're reached the end of the pattern, we're done.
-            if j == len(patMatch):
-                break
-            if not foundTheRightStar:
-                if patMatch[j] in [self._STAR, self._UNDERSCORE]: #we got a star
-                    numStars += 1
-                    if numStars == index:
-                        # This is the star we care about.
-                        foundTheRightStar = True
-                    start = i
-                    # Iterate through the rest of the string.
-                    for k in range (i, len(words)):
-                        # If the star is at the end of the pattern,
-                        # we know exactly where it ends.
-                        if j+1  == len (patMatch):
-                            end = len (words)
-                            break
-                        # If the words have started matching the
-                        # pattern again, the star has ended.
-                        if patMatch[j+1] == words[k]:
-                            end = k - 1
-                            i = k
-                            break
-                # If we just finished processing the star we cared
-                # about, we exit the loop early.
-                if foundTheRightStar:
-                    break
-            # Move to the next element of the pattern.
-            j += 1
-            
-        # extract the star words from the original, unmutilated input.
-        if foundTheRightStar:
-            #print( ' '.join(pattern.split()[start:end+1]) )
-            if starType == 'star': return ' '.join(pattern.split()[start:end+1])
-            elif starType == 'thatstar': return ' '.join(that.split()[start:end+1])
-            elif starType == 'topicstar': return ' '.join(topic.split()[start:end+1])
-        else: return u""
+        match = self.match(pattern, that, topic)
+        if match is None:
+            return ""
+        return match.star(starType, index)
 
     def _match(self, words, thatWords, topicWords, root):
-        """Return a tuple (pat, tem) where pat is a list of nodes, starting
-        at the root and leading to the matching pattern, and tem is the
-        matched template.
+        """Return a tuple (pat, tem, caps) where pat is a list of nodes,
+        starting at the root and leading to the matching pattern, tem is
+        the matched template and caps holds, for each of the input, that
+        and topic word lists, the (start, end) slices captured by each
+        '*' or '_' in order.
+
+        The node tree is walked depth-first with an explicit stack of
+        frames instead of recursing once per input word, so that long
+        inputs neither copy the word lists at every step nor run into
+        Python's recursion limit.  Alternatives are tried in the same
+        order as _matchRecursive(): '_', then the literal word, then the
+        bot's name and finally '*'.
+
+        A wildcard is only tried with the numbers of words after which,
+        according to _wildcardStats(), the rest of the input could
+        still match below it.
+
+        """
+        botKey = self._botKey()
+        inputs = (self._keys(words), self._keys(thatWords), self._keys(topicWords))
+        phaseKeys = (None, self._THAT, self._TOPIC)
+        getChild = self._child
+        prune = self._pruneWildcards
+        stats = self._stats
+        statKey = self._statKey
+        wildcardStats = self._wildcardStats
+
+        def split(child, seq, pos, remaining, consumed):
+            # Return the next number of words, after 'consumed', that the
+            # wildcard leading to child can eat, or 0 if there is none.
+            n = consumed + 1
+            if not prune:
+                return n if n <= remaining else 0
+            childStats = stats.get(statKey(child))
+            if childStats is None:
+                childStats = wildcardStats(child)
+            minWords, maxWords, nextKeys, nextBotName = childStats
+            n = max(n, remaining - maxWords)
+            while n <= remaining - minWords:
+                if nextKeys is None or n == remaining:
+                    return n
+                key = seq[pos+n]
+                if key in nextKeys or (nextBotName and key == botKey):
+                    return n
+                n += 1
+            return 0
 
-        """ 
+        # Each frame is [node, phase, position, stage, consumed].  'phase'
+        # selects the word list being matched (input, that or topic),
+        # 'position' is an index into that list, 'stage' tracks which
+        # alternative to try next and 'consumed' counts the words eaten
+        # by the wildcard currently being tried.
+        stack = [[root, 0, 0, 0, 0]]
+        # path[i] is the key used to go from stack[i] to stack[i+1]
+        path = []
+        while stack:
+            frame = stack[-1]
+            node, phase, pos, stage = frame[0], frame[1], frame[2], frame[3]
+            seq = inputs[phase]
+            remaining = len(seq) - pos
+            child = None
+
+            if remaining == 0:
+                # We're out of words in this phase.  First try to continue
+                # with the next non-empty phase, then fall back to the
+                # template stored at this node.
+                if stage == 0:
+                    frame[3] = 1
+                    for nextPhase in range(phase+1, 3):
+                        if len(inputs[nextPhase]) > 0:
+                            key = phaseKeys[nextPhase]
+                            child = getChild(node, key)
+                            childFrame = [child, nextPhase, 0, 0, 0]
+                            break
+                elif stage == 1:
+                    frame[3] = 2
+                    template = self._template(node)
+                    if template is not None:
+                        return (self._pathWords(path), template, self._captures(path, stack))
+            else:
+                first = seq[pos]
+                # Check underscore.
+                if stage == 0:
+                    child = getChild(node, self._UNDERSCORE)
+                    if child is not None:
+                        frame[4] = split(child, seq, pos, remaining, frame[4])
+                        if frame[4] == 0:
+                            child = None
+                    if child is not None:
+                        key = self._UNDERSCORE
+                        childFrame = [child, phase, pos+frame[4], 0, 0]
+                    else:
+                        frame[3] = stage = 1
+                        frame[4] = 0
+                # Check first
+                if stage == 1:
+                    frame[3] = stage = 2
+                    key = first
+                    child = getChild(node, key)
+                    childFrame = [child, phase, pos+1, 0, 0]
+                # check bot name
+                if stage == 2 and child is None:
+                    frame[3] = stage = 3
+                    if first == botKey:
+                        key = first
+                        child = getChild(node, self._BOT_NAME)
+                        childFrame = [child, phase, pos+1, 0, 0]
+                # check star
+                if stage == 3 and child is None:
+                    child = getChild(node, self._STAR)
+                    if child is not None:
+                        frame[4] = split(child, seq, pos, remaining, frame[4])
+                        if frame[4] == 0:
+                            child = None
+                    if child is not None:
+                        key = self._STAR
+                        childFrame = [child, phase, pos+frame[4], 0, 0]
+                    else:
+                        frame[3] = 4
+
+            if child is not None:
+                path.append(key)
+                stack.append(childFrame)
+            elif frame[3] >= (2 if remaining == 0 else 4):
+                # All alternatives at this node have been exhausted;
+                # backtrack to the parent.
+                stack.pop()
+                if path:
+                    path.pop()
+
+        # No matches were found.
+        if len(words) == 0:
+            return ([], None, None)
+        return (None, None, None)
+
+    def _wildcardStats(self, node):
+        """Return the statistics _match() uses to prune the words the
+        wildcard leading to node is tried with, computing them the first
+        time node is reached through a '_' or '*'.
+
+        The result is a tuple (minWords, maxWords, nextKeys, nextBotName):
+        the least and the most words of the current phase (input, that
+        or topic) that can be matched below the node (see
+        _phaseBounds()) and, unless the node has wildcard children
+        itself, the set of keys of its word children and whether it has
+        a bot name child, which the word following the wildcard has to
+        match.  nextKeys is None when the node has wildcard children.
+
+        The statistics are kept until add() or remove() changes a
+        category below the node, so only the parts of the tree that
+        matching visits are ever walked.
+        """
+        key = self._statKey(node)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._phaseBounds(node) + self._nextKeys(node)
+            self._stats[key] = stats
+        return stats
+
+    def _phaseBounds(self, node):
+        """Return a tuple (minWords, maxWords): the least and the most
+        words of the current phase that can be matched below node, _MANY
+        standing for any number, and maxWords being -1 if nothing can.
+
+        Only the nodes of the current phase below node are visited, and
+        their bounds are kept in self._bounds for the next calls.
+        """
+        MANY = self._MANY
+        wildcards = (self._UNDERSCORE, self._STAR)
+        phases = (self._THAT, self._TOPIC)
+        statKey = self._statKey
+        bounds = self._bounds
+        # Visit the nodes in post-order, with an explicit stack for the
+        # same reason as _match().
+        stack = [(node, None)]
+        while stack:
+            current, edges = stack.pop()
+            if edges is None:
+                if statKey(current) in bounds:
+                    continue
+                edges = self._edges(current)
+                stack.append((current, edges))
+                stack.extend((child, None) for key, child in edges
+                             if key not in phases)
+                continue
+            # The words left in a phase can end at a node holding a
+            # template or starting the next phase.
+            ends = self._template(current) is not None
+            minWords, maxWords = MANY, -1
+            for key, child in edges:
+                if key in phases:
+                    ends = True
+                    continue
+                childMin, childMax = bounds[statKey(child)]
+                if childMax < 0:
+                    continue # nothing can match below child
+                minWords = min(minWords, childMin + 1)
+                if key in wildcards:
+                    maxWords = MANY
+                else:
+                    maxWords = max(maxWords, min(MANY, childMax + 1))
+            if ends:
+                minWords = 0
+                maxWords = max(maxWords, 0)
+            bounds[statKey(current)] = (minWords, maxWords)
+        return bounds[statKey(node)]
+
+    def _forgetStats(self, nodes=None):
+        """Drop the statistics of _wildcardStats() and _phaseBounds() kept
+        for the given nodes, or for all of them.
+
+        Changing a category only changes the statistics of the nodes
+        leading to it, so add() and remove() pass those.
+        """
+        if nodes is None:
+            self._stats.clear()
+            self._bounds.clear()
+            return
+        statKey = self._statKey
+        for node in nodes:
+            key = statKey(node)
+            self._stats.pop(key, None)
+            self._bounds.pop(key, None)
+
+    def _nextKeys(self, node):
+        """Return the (nextKeys, nextBotName) pair of node described in
+        _wildcardStats()."""
+        keys = set()
+        botName = False
+        for key, child in self._edges(node):
+            if key == self._UNDERSCORE or key == self._STAR:
+                return None, False
+            if key == self._BOT_NAME:
+                botName = True
+            elif key != self._THAT and key != self._TOPIC:
+                keys.add(key)
+        return frozenset(keys), botName
+
+    # The node tree is only accessed through the following methods in
+    # _match() and _phaseBounds(), so that subclasses can store it in
+    # a different form.
+
+    def _matchRoot(self):
+        """Return the root node to start matching from."""
+        return self._root
+
+    # _child(node, key) returns the child of node under key, or None.
+    # For the dict-based tree this is just dict.get.
+    _child = staticmethod(dict.get)
+
+    def _edges(self, node):
+        """Return the (key, child) pairs of the children of node."""
+        return [(key, child) for key, child in node.items() if key != self._TEMPLATE]
+
+    # _statKey(node) returns the key of node in _wildcardStats(): the
+    # dict-based tree has no node numbers, but its nodes live as long
+    # as the statistics, which remove() and restore() drop with them.
+    _statKey = staticmethod(id)
+
+    def _template(self, node):
+        """Return the template stored at node, or None."""
+        return node.get(self._TEMPLATE)
+
+    def _keys(self, words):
+        """Convert a list of input words into node keys."""
+        return words
+
+    def _botKey(self):
+        """Return the node key matching the bot's name."""
+        return self._botName
+
+    def _pathWords(self, path):
+        """Convert a list of node keys back into words."""
+        return path
+
+    def _captures(self, path, stack):
+        """Return the word spans captured by the wildcards along the
+        current path of the _match() stack, grouped by phase.
+        """
+        captures = ([], [], [])
+        for i, key in enumerate(path):
+            if key == self._STAR or key == self._UNDERSCORE:
+                frame = stack[i]
+                captures[frame[1]].append((frame[2], stack[i+1][2]))
+        return captures
+
+    def _matchRecursive(self, words, thatWords, topicWords, root):
+        """Recursive reference implementation of _match().
+
+        This is the original matcher.  It recurses once per input word and
+        copies the remaining word list at each step, so it is no longer
+        used for matching; it is kept to check that _match() returns the
+        same results.
+
+        """
         # base-case: if the word list is empty, return the current node's
         # template.
         if len(words) == 0:
@@ -265,7 +657,7 @@ class PatternMgr:
                 # If thatWords isn't empty, recursively
                 # pattern-match on the _THAT node with thatWords as words.
                 try:
-                    pattern, template = self._match(thatWords, [], topicWords, root[self._THAT])
+                    pattern, template = self._matchRecursive(thatWords, [], topicWords, root[self._THAT])
                     if pattern != None:
                         pattern = [self._THAT] + pattern
                 except KeyError:
@@ -275,7 +667,7 @@ class PatternMgr:
                 # If thatWords is empty and topicWords isn't, recursively pattern
                 # on the _TOPIC node with topicWords as words.
                 try:
-                    pattern, template = self._match(topicWords, [], [], root[self._TOPIC])
+                    pattern, template = self._matchRecursive(topicWords, [], [], root[self._TOPIC])
                     if pattern != None:
                         pattern = [self._TOPIC] + pattern
                 except KeyError:
@@ -299,21 +691,21 @@ class PatternMgr:
             # where a * or _ is at the end of the pattern.
             for j in range(len(suffix)+1):
                 suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._UNDERSCORE])
+                pattern, template = self._matchRecursive(suf, thatWords, topicWords, root[self._UNDERSCORE])
                 if template is not None:
                     newPattern = [self._UNDERSCORE] + pattern
                     return (newPattern, template)
 
         # Check first
         if first in root:
-            pattern, template = self._match(suffix, thatWords, topicWords, root[first])
+            pattern, template = self._matchRecursive(suffix, thatWords, topicWords, root[first])
             if template is not None:
                 newPattern = [first] + pattern
                 return (newPattern, template)
 
         # check bot name
         if self._BOT_NAME in root and first == self._botName:
-            pattern, template = self._match(suffix, thatWords, topicWords, root[self._BOT_NAME])
+            pattern, template = self._matchRecursive(suffix, thatWords, topicWords, root[self._BOT_NAME])
             if template is not None:
                 newPattern = [first] + pattern
                 return (newPattern, template)
@@ -324,7 +716,7 @@ class PatternMgr:
             # where a * or _ is at the end of the pattern.
             for j in range(len(suffix)+1):
                 suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._STAR])
+                pattern, template = self._matchRecursive(suf, thatWords, topicWords, root[self._STAR])
                 if template is not None:
                     newPattern = [self._STAR] + pattern
                     return (newPattern, template)
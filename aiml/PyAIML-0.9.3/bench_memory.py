@@ -0,0 +1,53 @@
+"""
+This file contains a memory benchmark for the PatternMgr storage backends.
+It loads each brain from the Speak bot directory into the dict-based
+PatternMgr and into the array-based CompactPatternMgr, and reports the
+memory held by the brain, the peak memory while loading it and the time
+taken to match a set of sample inputs.
+
+Usage: python bench_memory.py [brain ...]   (default: alice sara alisochka)
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from test.test_patternmgr import load_brain, sample_inputs
+
+
+def measure(name, compact):
+    gc.collect()
+    tracemalloc.start()
+    pm = load_brain(name, compact)
+    if pm is None:
+        tracemalloc.stop()
+        return None
+    if compact:
+        pm._compact()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    inputs = sample_inputs(load_brain(name), 5000)
+    start = time.time()
+    root = pm._matchRoot()
+    for words, that, topic in inputs:
+        pm._match(words, that, topic, root)
+    elapsed = time.time() - start
+    return pm.numTemplates(), current, peak, len(inputs) / elapsed
+
+
+brains = sys.argv[1:] or ['alice', 'sara', 'alisochka']
+print( "%-10s %-8s %10s %10s %10s %12s" % ("brain", "storage", "categories",
+                                           "held MB", "peak MB", "matches/s") )
+for name in brains:
+    for compact in (False, True):
+        result = measure(name, compact)
+        if result is None:
+            print( "%-10s brain not found" % name )
+            break
+        count, current, peak, rate = result
+        print( "%-10s %-8s %10d %10.1f %10.1f %12.0f" % (
+            name, "compact" if compact else "dict", count,
+            current / 1048576., peak / 1048576., rate) )
@@ -0,0 +1,74 @@
+"""
+This file contains a benchmark for the AIML parser backends.  It parses
+every AIML file of the given brains in the Speak bot directory with each
+backend create_parser() offers, checks that they give the same
+categories and report the same parse errors, and reports the categories
+per second of each.
+
+The best of five runs is kept for each backend, but the results still
+vary by 10-20% from one run to the next, and neither backend is
+consistently faster.  Categories/s over three runs on one machine:
+
+                 sax           expat
+    alice        23.7k-31.2k   29.1k-35.5k
+    alisochka    36.0k-49.9k   34.1k-46.3k
+    sara         23.2k-40.1k   25.6k-47.8k
+
+On another, sax gave 32.4k, 33.0k and 26.7k, and expat 31.0k, 32.4k
+and 29.2k.
+
+Usage: python bench_parser.py [brain ...]   (default: alice alisochka sara)
+"""
+from __future__ import print_function
+
+import glob
+import io
+import os.path
+import sys
+import time
+
+from aiml.AimlParser import create_parser
+from test.test_patternmgr import BOTDIR
+
+BACKENDS = ("sax", "expat")
+
+
+def parse_all(backend, files):
+    """Parse files with backend.  Returns the categories of each file,
+    the parse errors reported and the seconds spent."""
+    results = []
+    stderr = sys.stderr
+    sys.stderr = errors = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+    try:
+        start = time.process_time()
+        for f in files:
+            parser = create_parser(backend)
+            parser.parse(f)
+            results.append(parser.getContentHandler().categories)
+        elapsed = time.process_time() - start
+    finally:
+        sys.stderr = stderr
+    return results, errors.getvalue(), elapsed
+
+
+names = sys.argv[1:] or ['alice', 'alisochka', 'sara']
+print( "%-10s %6s %10s %8s %14s" % ("brain", "files", "categories", "backend", "categories/s") )
+for name in names:
+    files = sorted(glob.glob(os.path.join(BOTDIR, name, '*.aiml')))
+    if not files:
+        sys.exit("%s AIML files not found" % name)
+    reference = None
+    best = {}
+    # alternate the backends, so that both see the same load
+    for p in range(5):
+        for backend in BACKENDS:
+            results, errors, elapsed = parse_all(backend, files)
+            best[backend] = min(best.get(backend, elapsed), elapsed)
+            if reference is None:
+                reference = results, errors
+            else:
+                assert results == reference[0], "%s: %s categories differ" % (name, backend)
+                assert errors == reference[1], "%s: %s errors differ" % (name, backend)
+    count = sum(len(categories) for categories in reference[0])
+    for backend in BACKENDS:
+        print( "%-10s %6d %10d %8s %14.0f" % (name, len(files), count, backend, count / best[backend]) )
@@ -0,0 +1,58 @@
+"""
+This file contains a throughput benchmark for KernelPool.  It loads a
+brain from the Speak bot directory once, then for each number of worker
+processes sends the same sample inputs, spread over several sessions,
+through KernelPool.respond_many() and reports the responses per second,
+along with the memory private to each worker (on Linux), which shows
+how much of the brain stayed shared.
+
+Usage: python bench_pool.py [brain] [max workers] [inputs]
+       (default: alice <number of CPUs> 3000)
+"""
+from __future__ import print_function
+
+import multiprocessing
+import sys
+import time
+
+import aiml
+from test.test_patternmgr import load_brain, sample_inputs
+
+
+def private_mb(pid):
+    """Return the memory written to by process pid since it was forked."""
+    try:
+        with open("/proc/%d/smaps_rollup" % pid) as f:
+            kb = sum(int(line.split()[1]) for line in f
+                     if line.startswith(("Private_Dirty:", "Private_Clean:")))
+        return kb / 1024.
+    except IOError:
+        return float("nan")
+
+
+name = sys.argv[1] if len(sys.argv) > 1 else 'alice'
+maxWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+count = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+pm = load_brain(name)
+if pm is None:
+    sys.exit("%s brain not found" % name)
+inputs = [u" ".join(words) for words, that, topic in sample_inputs(pm, count)]
+kern = aiml.Kernel()
+kern.verbose(False)
+kern._brain = pm
+# Measure matching and template processing, not cache hits.
+kern.setResponseCacheSize(0)
+
+print( "%-10s %8s %12s %16s" % ("brain", "workers", "responses/s", "private MB/worker") )
+workers = 1
+while workers <= maxWorkers:
+    pool = aiml.KernelPool(kernel=kern, workers=workers)
+    sessions = ["s%d" % (i % (8 * workers)) for i in range(len(inputs))]
+    start = time.time()
+    for future in pool.respond_many(inputs, sessions):
+        future.result()
+    rate = len(inputs) / (time.time() - start)
+    private = sum(private_mb(w.process.pid) for w in pool._workers) / workers
+    pool.close()
+    print( "%-10s %8d %12.0f %16.1f" % (name, workers, rate, private) )
+    workers *= 2
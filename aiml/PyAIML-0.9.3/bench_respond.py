@@ -0,0 +1,72 @@
+"""
+This file contains a benchmark for the template compiler.  It loads a
+brain from the Speak bot directory into one Kernel that interprets
+templates and one that compiles them, feeds both the same sample
+inputs and reports the responses per second of each, checking that
+the responses are identical.
+
+Usage: python bench_respond.py [brain] [inputs]   (default: alice 3000)
+"""
+from __future__ import print_function
+
+import glob
+import os.path
+import random
+import sys
+import time
+
+import aiml
+from test.test_patternmgr import BOTDIR, load_brain, sample_inputs
+
+
+def make_kernel(name, compileTemplates):
+    k = aiml.Kernel(compileTemplates=compileTemplates)
+    k.verbose(False)
+    brn = os.path.join(BOTDIR, name + '.brn')
+    if os.path.exists(brn):
+        k.loadBrain(brn)
+    else:
+        for f in sorted(glob.glob(os.path.join(BOTDIR, name, '*.aiml'))):
+            k.learn(f)
+    return k
+
+
+def run(k, inputs):
+    responses = []
+    start = time.process_time()
+    for i, input_ in enumerate(inputs):
+        random.seed(i)
+        responses.append(k.respond(input_, "bench"))
+    return responses, len(responses) / (time.process_time() - start)
+
+
+# Freeze <date>, so that the two runs give the same responses.
+time.asctime = lambda *args: "Sun Oct 18 12:00:00 2026"
+
+name = sys.argv[1] if len(sys.argv) > 1 else 'alice'
+count = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+pm = load_brain(name)
+if pm is None:
+    sys.exit("%s brain not found" % name)
+inputs = [u" ".join(words) for words, that, topic in sample_inputs(pm, count)]
+
+modes = [False, True]
+kernels = dict((mode, make_kernel(name, mode)) for mode in modes)
+rates = dict((mode, 0) for mode in modes)
+results = {}
+# The first pass decodes (and compiles) the templates.  The passes of the
+# two kernels are interleaved and the best of each is reported, to keep
+# the comparison fair on a noisy machine.
+for mode in modes:
+    run(kernels[mode], inputs)
+for r in range(5):
+    for mode in modes:
+        results[mode], rate = run(kernels[mode], inputs)
+        rates[mode] = max(rates[mode], rate)
+
+print( "%-10s %-12s %8s %12s" % ("brain", "templates", "inputs", "responses/s") )
+for mode in modes:
+    print( "%-10s %-12s %8d %12.0f" % (name, "compiled" if mode else "interpreted",
+                                       len(inputs), rates[mode]) )
+if results[False] != results[True]:
+    sys.exit("compiled responses differ from interpreted ones")
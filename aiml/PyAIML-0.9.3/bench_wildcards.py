@@ -0,0 +1,72 @@
+"""
+This file contains a benchmark for the wildcard pruning of the pattern
+matcher.  It loads a brain from the Speak bot directory and builds long
+adversarial inputs out of the words that follow a '*' or '_' in its
+patterns, which make the matcher try many ways of splitting the input
+between wildcards.  Each input is matched with and without the pruning
+of PatternMgr._wildcardStats(); the script checks that both give the
+same result, and reports the node lookups and the time taken by each.
+
+Usage: python bench_wildcards.py [brain] [inputs] [words per input]
+       (default: alice 50 20)
+"""
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from test.test_patternmgr import load_brain
+
+
+def count_lookups(pm):
+    """Make pm count its child lookups in counter[0]."""
+    counter = [0]
+    child = pm._child
+    def countingChild(node, key):
+        counter[0] += 1
+        return child(node, key)
+    pm._child = countingChild
+    return counter
+
+
+name = sys.argv[1] if len(sys.argv) > 1 else 'alice'
+count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+length = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+pm = load_brain(name)
+if pm is None:
+    sys.exit("%s brain not found" % name)
+
+# the words following wildcards, most frequent first
+start = time.process_time()
+stats = []
+nodes = [pm._matchRoot()]
+while nodes:
+    for key, child in pm._edges(nodes.pop()):
+        if key == pm._UNDERSCORE or key == pm._STAR:
+            stats.append(pm._wildcardStats(child))
+        nodes.append(child)
+print( "statistics of all %d wildcard nodes computed in %.2f seconds"
+       % (len(stats), time.process_time() - start) )
+pm._forgetStats()
+frequency = {}
+for minWords, maxWords, nextKeys, nextBotName in stats:
+    for key in nextKeys or ():
+        frequency[key] = frequency.get(key, 0) + 1
+vocabulary = sorted(frequency, key=lambda key: (-frequency[key], key))[:50]
+rnd = random.Random(0)
+inputs = [[rnd.choice(vocabulary) for i in range(length)] for n in range(count)]
+that = [u"ULTRABOGUSDUMMYTHAT"]
+topic = [u"ULTRABOGUSDUMMYTOPIC"]
+
+counter = count_lookups(pm)
+results = {}
+print( "%-10s %8s %14s %10s" % ("brain", "pruning", "node lookups", "seconds") )
+for prune in (False, True):
+    pm._pruneWildcards = prune
+    counter[0] = 0
+    start = time.process_time()
+    results[prune] = [pm._match(words, that, topic, pm._matchRoot()) for words in inputs]
+    elapsed = time.process_time() - start
+    print( "%-10s %8s %14d %10.2f" % (name, "on" if prune else "off", counter[0], elapsed) )
+assert results[False] == results[True]
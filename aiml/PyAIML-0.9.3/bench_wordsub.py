@@ -0,0 +1,57 @@
+"""
+This file contains a micro-benchmark for WordSub.  For each of the
+default substitutions (DefaultSubs), it runs sample inputs from the
+Speak bot directory (or, without them, a few built-in sentences) through
+the token trie and through the regex alternation WordSub.sub() chooses
+between, checks that both give the same output, and reports the
+substitutions per second of each.
+
+Usage: python bench_wordsub.py [brain] [inputs]
+       (default: alice 3000)
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from aiml import DefaultSubs
+from aiml.WordSub import WordSub
+from test.test_patternmgr import load_brain, sample_inputs
+
+
+def best_rate(f, texts, passes=5):
+    best = None
+    for p in range(passes):
+        start = time.process_time()
+        for text in texts:
+            f(text)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(texts) / best
+
+
+name = sys.argv[1] if len(sys.argv) > 1 else 'alice'
+count = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+pm = load_brain(name)
+if pm is not None:
+    texts = [u" ".join(words) for words, that, topic in sample_inputs(pm, count)]
+else:
+    texts = [u"I'm sure he said you're not what I'd call a robot, aren't you?",
+             u"She wants to know whether my computer likes her cat.",
+             u"What is your name", u"dont u think its time 2 go"] * (count // 4)
+# the subbers see sentences both as typed and in the bot's upper case
+texts += [text.lower() for text in texts]
+
+print( "%-10s %6s %14s %14s %8s" % ("subs", "keys", "regex subs/s", "trie subs/s", "sub()") )
+for subsName in ("defaultNormal", "defaultGender", "defaultPerson", "defaultPerson2"):
+    subber = WordSub(getattr(DefaultSubs, subsName))
+    subber._update_regex()
+    regexSub = lambda text: subber._regex.sub(subber, text)
+    trieSubber = WordSub(getattr(DefaultSubs, subsName))
+    trieSubber._trieMinKeys = 0
+    for text in texts:
+        assert regexSub(text) == trieSubber.sub(text), text
+    print( "%-10s %6d %14.0f %14.0f %8s" % (subsName[7:].lower(), len(subber),
+                                             best_rate(regexSub, texts),
+                                             best_rate(trieSubber.sub, texts),
+                                             "trie" if len(subber) >= WordSub._trieMinKeys else "regex") )
@@ -61,6 +61,7 @@ PyAIML (c) Cort Stratton
     entry_points = { 'console_scripts': [
         'aiml-validate = aiml.script.aimlvalidate:main',
         'aiml-bot = aiml.script.bot:main',
+        'aiml-brainconvert = aiml.script.brainconvert:main',
     ]},
 
     test_suite = 'test.__main__.load_tests',
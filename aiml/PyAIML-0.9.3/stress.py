@@ -2,34 +2,96 @@
 This file contains the PyAIML stress test.  It creates two bots, and connects
 them in a cyclic loop.  A lot of output is generated; piping the results to
 a log file is highly recommended.
+
+With --threads N it runs a multi-threaded benchmark instead: inputs built
+from the brain's patterns are sent by N threads, each in its own session,
+first with a Kernel serializing all responses and then with a concurrent
+Kernel (per-session locks), and the responses per second of each are
+reported.
+
+Usage: python stress.py [--threads N] [--inputs N] [--rounds N] [--brain FILE]
 """
 from __future__ import print_function
 
+import argparse
+import threading
+import time
+
 import aiml
+from test.test_patternmgr import sample_inputs
+
+
+def make_kernel(args, **kwargs):
+    kern = aiml.Kernel(**kwargs)
+    kern.verbose(False)
+    if args.brain:
+        kern.bootstrap(brainFile=args.brain)
+    else:
+        kern.bootstrap(learnFiles="std-startup.xml", commands="load aiml b")
+    return kern
+
+
+def stress(args):
+    # Create the kernels
+    print( "Initializing Kernel #1" )
+    kern1 = make_kernel(args)
+    kern1.saveBrain("standard.brn")
+    print( "\nInitializing Kernel #2" )
+    kern2 = aiml.Kernel()
+    kern2.verbose(False)
+    kern2.bootstrap(brainFile="standard.brn")
+
+    # Start the bots off with some basic input.
+    response = "askquestion"
+
+    # Off they go!
+    while True:
+        response = kern1.respond(response).strip()
+        print( "1:", response, "\n" )
+        response = kern2.respond(response).strip()
+        print( "2:", response, "\n" )
+        # If the robots have run out of things to say, force one of them
+        # to break the ice.
+        if response == "":
+            response = "askquestion"
+
+
+def replay(kern, n, inputs, rounds):
+    for r in range(rounds):
+        for input_ in inputs:
+            kern.respond(input_, str(n))
+
+
+def threaded(args):
+    inputs = None
+    print( "%-12s %8s %12s" % ("locking", "threads", "responses/s") )
+    for concurrent in (False, True):
+        kern = make_kernel(args, concurrent=concurrent)
+        # Measure matching and template processing, not cache hits.
+        kern.setResponseCacheSize(0)
+        if inputs is None:
+            inputs = [u" ".join(words) for words, that, topic
+                      in sample_inputs(kern._brain, args.inputs)]
+        threads = [threading.Thread(target=replay, args=(kern, n, inputs, args.rounds))
+                   for n in range(args.threads)]
+        start = time.time()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.time() - start
+        print( "%-12s %8d %12.0f" % ("session" if concurrent else "global", args.threads,
+                                     args.threads * args.rounds * len(inputs) / elapsed) )
+
 
-# Create the kernels
-kern1 = aiml.Kernel()
-kern1.verbose(False)
-kern2 = aiml.Kernel()
-kern2.verbose(False)
-
-# Initialize the kernels
-print( "Initializing Kernel #1" )
-kern1.bootstrap(learnFiles="std-startup.xml", commands="load aiml b")
-kern1.saveBrain("standard.brn")
-print( "\nInitializing Kernel #2" )
-kern2.bootstrap(brainFile="standard.brn")
-
-# Start the bots off with some basic input.
-response = "askquestion"
-
-# Off they go!
-while True:
-    response = kern1.respond(response).strip()
-    print( "1:", response, "\n" )
-    response = kern2.respond(response).strip()
-    print( "2:", response, "\n" )
-    # If the robots have run out of things to say, force one of them
-    # to break the ice.
-    if response == "":
-        response = "askquestion"
+parser = argparse.ArgumentParser(description='PyAIML stress test')
+parser.add_argument( '--threads', type=int,
+                     help='Run the multi-threaded benchmark with this many threads' )
+parser.add_argument( '--inputs', type=int, default=1000,
+                     help='Number of inputs sent by each thread (default: 1000)' )
+parser.add_argument( '--rounds', type=int, default=3,
+                     help='Number of times each thread sends them (default: 3)' )
+parser.add_argument( '--brain', help='Brain file to load instead of the standard AIML set' )
+args = parser.parse_args()
+if args.threads:
+    threaded(args)
+else:
+    stress(args)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import unittest
+import xml.sax
+
+from aiml.AimlParser import create_parser
+
+SELF_TEST = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+
+SPLIT_AIML = u"""<?xml version="1.0" encoding="UTF-8"?>
+<aiml version="1.0">
+<category>
+<pattern>HELLO <bot name="name"/> THERE</pattern>
+<that>HI</that>
+<template>one two <star/> three &amp; four</template>
+</category>
+<topic name="WEATHER">
+<category>
+<pattern>HELLO *</pattern>
+<template><random><li>sunny</li> <li>rain <get name="x"/>y</li></random></template>
+</category>
+</topic>
+<category>
+<pattern>HELLO *</pattern>
+<template>a <bogus>b</bogus> c</template>
+</category>
+</aiml>
+"""
+
+
+class TestAimlParser( unittest.TestCase ):
+
+    longMessage = True
+
+    def _parse(self, chunks=None, filename=SELF_TEST):
+        """Parse the AIML text fed in chunks, or filename, and return the
+        categories, as stored and as streamed."""
+        parser = create_parser()
+        handler = parser.getContentHandler()
+        streamParser = create_parser()
+        streamed = []
+        streamParser.getContentHandler().setCategoryHandler(
+            lambda key, tem: streamed.append((key, tem)))
+        for p in (parser, streamParser):
+            if chunks is None:
+                p.parse(filename)
+            else:
+                for chunk in chunks:
+                    p.feed(chunk)
+                p.close()
+        return handler.categories, streamed
+
+    def test01_stream( self ):
+        stored, streamed = self._parse()
+        self.assertEqual(len(stored), len(streamed))
+        self.assertEqual(stored, dict(streamed))
+        self.assertEqual(0, len(create_parser().getContentHandler().categories))
+
+    def test02_split_text( self ):
+        # feeding the text a few bytes at a time splits its character data
+        text = SPLIT_AIML.encode("utf-8")
+        stored, streamed = self._parse([text[i:i+3] for i in range(0, len(text), 3)])
+        whole = self._parse([text])[0]
+        self.assertEqual(whole, stored)
+        self.assertEqual([(u"HELLO  BOT_NAME  THERE", u"HI", u"*"),
+                          (u"HELLO *", u"*", u"WEATHER"),
+                          (u"HELLO *", u"*", u"*")], [key for key, tem in streamed])
+        self.assertEqual(['template', {},
+                          ['text', {'xml:space': 'default'}, u'one two '],
+                          ['star', {}],
+                          ['text', {'xml:space': 'default'}, u' three & four']],
+                         streamed[0][1])
+        self.assertEqual(['text', {'xml:space': 'default'}, u'rain '],
+                         streamed[1][1][2][3][2])
+        # the text around an ignored element is a single text element
+        self.assertEqual(['template', {}, ['text', {'xml:space': 'default'}, u'a  c']],
+                         streamed[2][1])
+
+    def test03_backends( self ):
+        text = SPLIT_AIML.encode("utf-8")
+        chunks = [text[i:i+7] for i in range(0, len(text), 7)]
+        for backend in ("sax", "expat"):
+            for source in (SELF_TEST, chunks):
+                stored, streamed = {}, []
+                parser = create_parser(backend)
+                parser.getContentHandler().setCategoryHandler(
+                    lambda key, tem: streamed.append((key, tem)))
+                if source is chunks:
+                    for chunk in chunks:
+                        parser.feed(chunk)
+                    parser.close()
+                    stored = self._parse(chunks)[0]
+                else:
+                    parser.parse(source)
+                    stored = self._parse()[0]
+                self.assertEqual(stored, dict(streamed), backend)
+        self.assertRaises(ValueError, create_parser, "dom")
+
+    def test04_backend_errors( self ):
+        text = b'<aiml version="1.0"><category><pattern>A</pattern>\n<template>x</templat></category></aiml>'
+        messages = []
+        for backend in ("sax", "expat"):
+            parser = create_parser(backend)
+            with self.assertRaises(xml.sax.SAXParseException) as cm:
+                parser.feed(text)
+                parser.close()
+            messages.append((cm.exception.getMessage(), cm.exception.getLineNumber(),
+                             cm.exception.getColumnNumber()))
+        self.assertEqual(("mismatched tag", 2, 13), messages[0])
+        self.assertEqual(messages[0], messages[1])
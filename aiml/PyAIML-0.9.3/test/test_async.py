@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from aiml import Kernel
+
+SLEEPY_AIML = u"""<?xml version="1.0" encoding="UTF-8"?>
+<aiml version="1.0">
+<category>
+<pattern>SLEEP *</pattern>
+<template>I slept <system>sleep <star/>; echo well</system></template>
+</category>
+<category>
+<pattern>SLEEP TWICE</pattern>
+<template><srai>SLEEP 5</srai> <srai>SLEEP 5</srai></template>
+</category>
+</aiml>
+"""
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio coroutines need Python 3.5")
+@unittest.skipUnless(os.name == "posix", "the tests use the sleep command")
+class TestAsyncKernel( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        import asyncio
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+        self.dir = tempfile.mkdtemp()
+        sleepy = os.path.join(self.dir, "sleepy.aiml")
+        with open(sleepy, "w") as f:
+            f.write(SLEEPY_AIML)
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.k.learn(sleepy)
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.dir)
+
+    def test01_respond( self ):
+        for input_ in ["test bot", "test system", "test that", "test input"]:
+            expected = self.k.respond(input_, "sync")
+            response = self.loop.run_until_complete(self.k.respond_async(input_, "async"))
+            self.assertEqual(expected, response, input_)
+        self.assertEqual("I slept well", self.loop.run_until_complete(
+            self.k.respond_async("sleep 0")))
+
+    def test02_system_timeout( self ):
+        start = time.time()
+        response = self.loop.run_until_complete(
+            self.k.respond_async("sleep 5", systemTimeout=0.2))
+        self.assertLess(time.time() - start, 4)
+        self.assertEqual("I slept There was an error while computing my response.  "
+                         "Please inform my botmaster.", response)
+
+    def test03_cancel( self ):
+        asyncio = self.asyncio
+        async def cancel():
+            task = asyncio.ensure_future(self.k.respond_async("sleep twice", "s"))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+        start = time.time()
+        self.assertTrue(self.loop.run_until_complete(cancel()))
+        # the session is usable, and has no trace of the cancelled input,
+        # once the executor thread has given up
+        self.assertEqual("The system says hello!",
+                         self.loop.run_until_complete(self.k.respond_async("test system", "s")))
+        self.assertLess(time.time() - start, 4)
+        self.assertEqual(["test system"], self.k.getPredicate("_inputHistory", "s"))
+        self.assertEqual([], self.k.getPredicate("_inputStack", "s"))
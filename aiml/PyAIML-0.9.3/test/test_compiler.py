@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import random
+import unittest
+
+from aiml import Kernel
+
+from . import test_kernel
+from .test_patternmgr import BOTDIR, load_brain, sample_inputs
+
+
+class TestCompiledKernel( test_kernel.TestKernel ):
+    """Run the Kernel tests with compiled templates."""
+
+    def setUp(self):
+        self.k = Kernel(compileTemplates=True)
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        self.k.bootstrap(learnFiles=testfile)
+
+
+class TestTemplateCompiler( unittest.TestCase ):
+
+    longMessage = True
+
+    def _kernel(self, compileTemplates):
+        k = Kernel(compileTemplates=compileTemplates)
+        k.verbose(False)
+        k.setBotPredicate("name", "Speak")
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        return k
+
+    def test01_cache( self ):
+        k = self._kernel(True)
+        k._compiler._cacheSize = 2
+        for input_ in ["test bot", "test id", "test size", "test bot"]:
+            k.respond(input_)
+        self.assertEqual(2, len(k._compiler._cache))
+
+    def test02_custom_handler( self ):
+        # handlers replaced in _elementProcessors are still used
+        k = self._kernel(True)
+        k._elementProcessors["bot"] = lambda elem, sessionID: "Custom"
+        self.assertEqual("My name is Custom", k.respond("test bot"))
+
+    def test03_reset_brain( self ):
+        k = self._kernel(True)
+        k.resetBrain()
+        self.assertIsNotNone(k._compiler)
+
+    def _compareBrain(self, name):
+        brn = os.path.join(BOTDIR, name + '.brn')
+        if not os.path.exists(brn):
+            self.skipTest("%s brain not available" % name)
+        # Each Kernel gets its own copy of the brain, as the interpreter
+        # rewrites the templates it processes.
+        interpreted = Kernel()
+        compiled = Kernel(compileTemplates=True)
+        for k in (interpreted, compiled):
+            k.verbose(False)
+            k.loadBrain(brn)
+        pm = load_brain(name)
+        for i, (words, that, topic) in enumerate(sample_inputs(pm, 500)):
+            input_ = u" ".join(words)
+            random.seed(i)
+            expected = interpreted.respond(input_)
+            random.seed(i)
+            got = compiled.respond(input_)
+            self.assertEqual(expected, got, msg="input=%s" % input_)
+
+    def test04_sara( self ):
+        self._compareBrain('sara')
+
+    def test05_alisochka( self ):
+        self._compareBrain('alisochka')
+
+    def test06_handler_replaced_later( self ):
+        # replacing a handler after its templates were compiled
+        for compileTemplates in (False, True):
+            k = self._kernel(compileTemplates)
+            self.assertEqual("The Last Word Should Be UPPERCASE", k.respond("test uppercase"))
+            k._elementProcessors["uppercase"] = lambda elem, sessionID: "CUSTOM"
+            self.assertEqual("The Last Word Should Be CUSTOM", k.respond("test uppercase"), compileTemplates)
+            # and putting the Kernel's own back
+            k._elementProcessors["uppercase"] = k._processUppercase
+            self.assertEqual("The Last Word Should Be UPPERCASE", k.respond("test uppercase"), compileTemplates)
+
+
+if __name__ == "__main__":
+    unittest.main()
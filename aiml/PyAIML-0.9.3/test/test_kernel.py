@@ -1,9 +1,14 @@
 # -*- coding: latin-1 -*-
 
 from __future__ import print_function
+import io
 import time
 import os.path
+import shutil
+import tempfile
+import threading
 import unittest
+from unittest import mock
 
 from aiml import Kernel
 
@@ -141,6 +146,187 @@ class TestKernel( unittest.TestCase ):
     def test18_whitespace( self ):
         self._testTag('whitespace preservation', 'test whitespace', ["Extra   Spaces\n   Rule!   (but not in here!)    But   Here   They   Do!"])
 
+    def test19_response_cache( self ):
+        self.k.verbose(False)
+        # the cache is off by default
+        self.assertEqual(self.k.responseCacheInfo(), (0, 0, 0, 0))
+        self.k.respond('test srai', 'x')
+        self.assertEqual(self.k.responseCacheInfo(), (0, 0, 0, 0))
+        self.k.setResponseCacheSize(1024)
+        # the cache is keyed on the input, 'that' and topic, so it is
+        # shared by sessions in the same state
+        self.k.respond('test srai', 'a')
+        self.assertEqual(self.k.respond('test srai', 'b'), "srai test passed")
+        self.assertEqual(self.k.responseCacheInfo(), (1, 1, 1024, 1))
+        # templates using <random>, even through <sr>, are not cached
+        self.k.respond('test nested sr test random', 'c')
+        self.k.respond('test nested sr test random', 'd')
+        info = self.k.responseCacheInfo()
+        self.assertEqual((info.hits, info.currsize), (1, 1))
+        # learning invalidates the cache
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.assertEqual(self.k.responseCacheInfo().currsize, 0)
+        self.k.setResponseCacheSize(0)
+        self.k.respond('test srai')
+        self.assertEqual(self.k.responseCacheInfo(), (1, 3, 0, 0))
+        # its bookkeeping is not part of the session data
+        for key in (self.k._cacheable, self.k._context, self.k._matchStack):
+            self.assertFalse(key in self.k.getSessionData('a'), key)
+            self.assertFalse(key in self.k.getSessionData()['a'], key)
+        self.assertEqual(self.k.getSessionData('a')['_inputHistory'], ['test srai'])
+
+    def test20_respond_batch( self ):
+        self.k.verbose(False)
+        inputs = ["test srai", "test thatstar", "test thatstar. test input", "",
+                  "test get and set", "test that", "test input", "test version"]
+        sessions = ["a", "b", "a", "a", "b", "b", "a", "b"]
+        results = self.k.respond_batch(inputs, sessions)
+        # the same as answering each session's inputs in turn
+        expected = [self.k.respond(input_, sessionID + "2")
+                    for input_, sessionID in zip(inputs, sessions)]
+        self.assertEqual(expected, [r.response for r in results])
+        self.assertTrue(all(r.seconds >= 0 for r in results))
+        self.assertEqual(self.k.getPredicate("_inputHistory", "a"),
+                         self.k.getPredicate("_inputHistory", "a2"))
+        self.assertEqual(self.k.respond_batch(["test bot"])[0].response,
+                         "My name is Nameless")
+        self.assertRaises(ValueError, self.k.respond_batch, ["test bot"], [])
+
+    def test21_learn_files( self ):
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        progress = []
+        k = Kernel()
+        k.verbose(False)
+        k.learnFiles([testfile, testfile], workers=2,
+                     progress=lambda f, done, total, seconds: progress.append((done, total)))
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertEqual(k.numCategories(), self.k.numCategories())
+        for input_ in ["test bot", "test srai", "test star ham middle", "test system"]:
+            self.assertEqual(k.respond(input_), self.k.respond(input_), input_)
+
+    def test22_context_cache( self ):
+        self.k.verbose(False)
+        self.k.respond("test srai", "s")
+        context = self.k._normalizeContext("s")
+        self.assertEqual(context[:2], ("srai test passed", ""))
+        # reused until the output history, the topic or the subbers change
+        self.assertTrue(self.k._normalizeContext("s")[2] is context[2])
+        self.k.setPredicate("topic", "fruit", "s")
+        self.assertEqual(self.k._normalizeContext("s")[2][3], [("FRUIT", 0, 5)])
+        self.k.respond("test bot", "s")
+        self.assertEqual([t[0] for t in self.k._normalizeContext("s")[2][2]],
+                         ["MY", "NAME", "IS", "NAMELESS"])
+        self.k._subbersVersion += 1
+        self.assertFalse(self.k._normalizeContext("s")[2] is context[2])
+
+    def test23_reset_brain( self ):
+        self.k.verbose(False)
+        self.k.respond("test srai", "s")
+        locks = (self.k._brainLock, self.k._sessionLock("s"), self.k._cacheLock)
+        self.k.resetBrain()
+        # threads waiting for the locks still exclude each other
+        self.assertEqual(locks, (self.k._brainLock, self.k._sessionLock("s"), self.k._cacheLock))
+        self.assertEqual(self.k.numCategories(), 0)
+        self.assertEqual(list(self.k.getSessionData()), [self.k._globalSessionID])
+        self.assertEqual(self.k.getBotPredicate("name"), "Nameless")
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.assertEqual(self.k.respond("test srai", "s"), "srai test passed")
+
+    def test26_truncated_file( self ):
+        # a file with a fatal parse error is not learned at all, by
+        # learn() as by learnFiles()
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, "truncated.aiml")
+            with open(filename, "w") as f:
+                f.write('<?xml version="1.0"?>\n<aiml version="1.0">\n'
+                        '<category><pattern>TRUNCATED ONE</pattern><template>one</template></category>\n'
+                        '<category><pattern>TRUNCATED TWO</pattern><template>tw')
+            count = self.k.numCategories()
+            errors = io.StringIO()
+            with mock.patch("sys.stderr", errors):
+                self.k.learn(filename)
+                self.k.learnFiles([filename, filename], workers=2)
+            self.assertEqual(self.k.numCategories(), count)
+            self.assertEqual(errors.getvalue().count("FATAL PARSE ERROR in file %s" % filename), 3)
+        finally:
+            shutil.rmtree(path)
+
         # Run an interactive interpreter
         #print( "\nEntering interactive mode (ctrl-c to exit)" )
         #while True: print( self.k.respond(raw_input("> ")) )
+
+
+class TestConcurrentKernel( TestKernel ):
+    """Run the Kernel tests with per-session locking."""
+
+    def setUp(self):
+        self.k = Kernel(concurrent=True)
+        testfile = os.path.join(os.path.dirname(__file__),"self-test.aiml")
+        self.k.bootstrap(learnFiles=testfile)
+
+    def test24_threads( self ):
+        self.k.verbose(False)
+        inputs = ["test srai", "test thatstar", "test thatstar", "test star ham middle",
+                  "test get and set", "test nested sr test srai", "test input", "test id"]
+        expected = {}
+        for n in range(8):
+            serial = Kernel()
+            serial.verbose(False)
+            serial.learn(os.path.join(os.path.dirname(__file__),"self-test.aiml"))
+            expected["s%d" % n] = [serial.respond(input_, "s%d" % n) for input_ in inputs]
+        results = {}
+        def converse(sessionID):
+            results[sessionID] = [self.k.respond(input_, sessionID) for input_ in inputs]
+        threads = [threading.Thread(target=converse, args=(sessionID,)) for sessionID in expected]
+        for t in threads: t.start()
+        # learning while responding waits for the responses in progress
+        self.k.learn(os.path.join(os.path.dirname(__file__),"self-test.aiml"))
+        for t in threads: t.join()
+        self.assertEqual(expected, results)
+
+    def test25_learn_in_session( self ):
+        # a <learn> waits for the brain's readers, none of which may be
+        # waiting for its session
+        self.k.verbose(False)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            learnfile = os.path.join(tmpdir, "learn.aiml")
+            with open(learnfile, "w") as f:
+                f.write("""<?xml version="1.0" encoding="ISO-8859-1"?>
+<aiml version="1.0"><category><pattern>TEST LEARN</pattern>
+<template><learn>%s</learn>learned</template></category></aiml>
+""" % os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+            self.k.learn(learnfile)
+            self.k.respond("test srai", "s")
+
+            # hold the <learn> back until another request in the same
+            # session is under way
+            learning = threading.Event()
+            proceed = threading.Event()
+            lock = self.k._brainLock
+            acquireWrite = lock.acquireWrite
+            def heldAcquireWrite():
+                learning.set()
+                proceed.wait(5)
+                acquireWrite()
+            lock.acquireWrite = heldAcquireWrite
+
+            results = {}
+            def converse(input_):
+                results[input_] = self.k.respond(input_, "s")
+            first = threading.Thread(target=converse, args=("test learn",))
+            second = threading.Thread(target=converse, args=("test srai",))
+            first.daemon = second.daemon = True
+            first.start()
+            self.assertTrue(learning.wait(5))
+            second.start()
+            time.sleep(0.1)
+            proceed.set()
+            first.join(5)
+            second.join(5)
+            self.assertFalse(first.is_alive() or second.is_alive(), "deadlock")
+            self.assertEqual({"test learn": "learned", "test srai": "srai test passed"},
+                             results)
+        finally:
+            shutil.rmtree(tmpdir)
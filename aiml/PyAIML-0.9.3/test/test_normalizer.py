@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import re
+import unittest
+
+from aiml.Normalizer import Normalizer
+
+
+class TestNormalizer( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.normalizer = Normalizer()
+
+    def test01_words( self ):
+        punctuation = r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?"""
+        puncStripRE = re.compile("[" + re.escape(punctuation) + "]")
+        for text in [u"Hello, how're you?", u"", u"  ", u"ça va?\tÇA\nVA!",
+                     u"e-mail me_at [x]", u"straße 12.5%", u"Straße-ß, ok"]:
+            self.assertEqual( re.sub(puncStripRE, " ", text.upper()).split(),
+                              [t[0] for t in self.normalizer.tokens(text)], text )
+
+    def test02_offsets( self ):
+        text = u" Hello,  how're\tyou? "
+        self.assertEqual( [(u"HELLO", 1, 6), (u"HOW", 9, 12), (u"RE", 13, 15), (u"YOU", 16, 19)],
+                          self.normalizer.tokens(text) )
+        self.assertEqual( [], self.normalizer.tokens(u" ") )
+        # the offsets are in the text as typed, even if upper-casing
+        # makes it longer
+        text = u"Straße-ß, ok"
+        self.assertEqual( [u"Straße", u"ß", u"ok"],
+                          [text[s:e] for w, s, e in self.normalizer.tokens(text)] )
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import glob
+import marshal
+import os
+import os.path
+import random
+import tempfile
+import unittest
+
+from aiml import BrainFile
+from aiml import Kernel
+from aiml.CompactPatternMgr import CompactPatternMgr
+from aiml.PatternMgr import PatternMgr
+
+
+BOTDIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'bot')
+
+_brains = {}
+
+def load_brain(name, compact=False):
+    """Return a PatternMgr holding the named brain from the bot directory.
+
+    Brains are loaded from their .brn file when present, otherwise learned
+    from the AIML sources.  Returns None if neither is available.
+    """
+    if (name, compact) in _brains:
+        return _brains[name, compact]
+    brn = os.path.join(BOTDIR, name + '.brn')
+    sources = sorted(glob.glob(os.path.join(BOTDIR, name, '*.aiml')))
+    k = Kernel(compactBrain=compact)
+    k.verbose(False)
+    if os.path.exists(brn):
+        k.loadBrain(brn)
+    elif sources:
+        for f in sources:
+            k.learn(f)
+    else:
+        return None
+    _brains[name, compact] = k._brain
+    return k._brain
+
+
+def decoded(pm, result):
+    """Decode the template in a result returned by pm._match()."""
+    pattern, template, captures = result
+    if template is not None:
+        template = pm._decodeTemplate(template)
+    return pattern, template, captures
+
+
+def sample_inputs(pm, count, seed=0):
+    """Build (input, that, topic) word lists exercising the patterns stored
+    in the PatternMgr 'pm'.
+    """
+    rnd = random.Random(seed)
+    fillers = [u"HELLO", u"YOU", u"ARE", u"A", u"ROBOT", u"WHAT", u"IS",
+               u"MY", u"NAME", u"ZZYZX", u"I", u"LIKE", u"CATS"]
+
+    def patterns(node, key, limit):
+        # collect the 'that' word lists stored below node[key]
+        found = []
+        stack = [(node[key], [])]
+        while stack and len(found) < limit:
+            n, words = stack.pop()
+            if PatternMgr._TOPIC in n:
+                found.append(words)
+            for k in n:
+                if k in (PatternMgr._UNDERSCORE, PatternMgr._STAR):
+                    stack.append((n[k], words + [k]))
+                elif not isinstance(k, int):
+                    stack.append((n[k], words + [k]))
+        return found
+
+    def fill(words):
+        out = []
+        for w in words:
+            if w in (PatternMgr._UNDERSCORE, PatternMgr._STAR):
+                out.extend(rnd.choice(fillers) for i in range(rnd.randint(1, 3)))
+            else:
+                out.append(w)
+        return out
+
+    # gather pattern word lists from the input part of the trie
+    pats = []
+    stack = [(pm._root, [])]
+    while stack:
+        n, words = stack.pop()
+        if PatternMgr._THAT in n:
+            pats.append((n, words))
+        for k in n:
+            if not isinstance(k, int) or k in (PatternMgr._UNDERSCORE, PatternMgr._STAR):
+                stack.append((n[k], words + [k]))
+    rnd.shuffle(pats)
+
+    result = []
+    for n, words in pats[:count]:
+        thats = patterns(n, PatternMgr._THAT, 5)
+        that = fill(rnd.choice(thats)) if thats else []
+        if not that or rnd.random() < 0.5:
+            that = [u"ULTRABOGUSDUMMYTHAT"]
+        topic = [u"ULTRABOGUSDUMMYTOPIC"]
+        input_ = fill(words)
+        # perturb some of the inputs so that they need backtracking
+        r = rnd.random()
+        if r < 0.2 and len(input_) > 1:
+            del input_[rnd.randrange(len(input_))]
+        elif r < 0.4:
+            input_.insert(rnd.randrange(len(input_)+1), rnd.choice(fillers))
+        result.append((input_, that, topic))
+    return result
+
+
+class TestPatternMgr( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.pm = PatternMgr()
+        self.pm.add((u"HELLO *", u"*", u"*"), ["template", {}, "a"])
+        self.pm.add((u"HELLO _ BYE", u"*", u"*"), ["template", {}, "b"])
+        self.pm.add((u"HELLO BOT_NAME", u"*", u"*"), ["template", {}, "c"])
+        self.pm.add((u"*", u"WHAT IS YOUR NAME", u"*"), ["template", {}, "d"])
+        self.pm.add((u"*", u"*", u"*"), ["template", {}, "e"])
+        self.pm.setBotName(u"ROBBIE")
+
+    def tearDown(self):
+        del self.pm
+
+    def _compare(self, words, that, topic):
+        expected = self.pm._matchRecursive(words, that, topic, self.pm._root)
+        got = self.pm._match(words, that, topic, self.pm._root)[:2]
+        self.assertEqual(expected, got, msg="input=%s that=%s" % (words, that))
+        return decoded(self.pm, got + (None,))[:2]
+
+    def test01_priority( self ):
+        dummy = [u"ULTRABOGUSDUMMYTOPIC"]
+        pat, tem = self._compare([u"HELLO", u"THERE", u"BYE"], [u"X"], dummy)
+        self.assertEqual(tem[2], "b")
+        pat, tem = self._compare([u"HELLO", u"ROBBIE"], [u"X"], dummy)
+        self.assertEqual(tem[2], "c")
+        self.assertEqual(pat[:2], [u"HELLO", u"ROBBIE"])
+        pat, tem = self._compare([u"HELLO", u"ROBBIE", u"SMITH"], [u"X"], dummy)
+        self.assertEqual(tem[2], "a")
+        pat, tem = self._compare([u"FOO"], [u"WHAT", u"IS", u"YOUR", u"NAME"], dummy)
+        self.assertEqual(tem[2], "d")
+        pat, tem = self._compare([u"FOO"], [u"WHAT", u"IS", u"IT"], dummy)
+        self.assertEqual(tem[2], "e")
+
+    def test02_empty( self ):
+        self._compare([], [u"X"], [u"Y"])
+        self._compare([], [], [])
+        self._compare([u"A"], [], [])
+        self.assertEqual(PatternMgr()._match([u"A"], [u"B"], [u"C"], {}), (None, None, None))
+
+    def test03_long_input( self ):
+        words = [u"WORD"] * 5000 + [u"BYE"]
+        pat, tem, caps = decoded(self.pm, self.pm._match([u"HELLO"] + words, [u"X"], [u"Y"], self.pm._root))
+        self.assertEqual(tem[2], "b")
+
+    def test04_captures( self ):
+        self.pm.add((u"I LIKE * AND *", u"DO YOU LIKE *", u"_ FOOD"), ["template", {}, "f"])
+        m = self.pm.match(u"I like green eggs and ham", u"Do you like food?", u"Good fast food")
+        self.assertEqual(m.template[2], "f")
+        self.assertEqual(m.star("star", 1), u"green eggs")
+        self.assertEqual(m.star("star", 2), u"ham")
+        self.assertEqual(m.star("star", 3), u"")
+        self.assertEqual(m.star("thatstar", 1), u"food")
+        self.assertEqual(m.star("topicstar", 1), u"Good fast")
+        self.assertRaises(ValueError, m.star, "bogus", 1)
+        self.assertEqual(self.pm.star("star", u"I like green eggs and ham",
+                                      u"Do you like food?", u"Good fast food", 1),
+                         u"green eggs")
+        self.assertEqual(self.pm.match(u"", u"", u""), None)
+        # stars are sliced from the words as typed, whatever the spacing
+        m = self.pm.match(u" I  like\tgreen  eggs and\n ham ", u"Do you like food?", u"Good fast food")
+        self.assertEqual(m.star("star", 1), u"green eggs")
+        self.assertEqual(m.star("star", 2), u"ham")
+        # and line up with the words matched when punctuation splits one
+        m = self.pm.match(u"I like rock'n'roll and ham!", u"Do you like food?", u"Good fast food")
+        self.assertEqual(m.star("star", 1), u"rock'n'roll")
+        self.assertEqual(m.star("star", 2), u"ham")
+
+    def test05_template_cache( self ):
+        self.pm.setTemplateCacheSize(1)
+        self.assertTrue(isinstance(self.pm._root[u"HELLO"][self.pm._STAR][self.pm._THAT]
+                                   [self.pm._STAR][self.pm._TOPIC][self.pm._STAR][self.pm._TEMPLATE], bytes))
+        a = self.pm.match(u"hello you", u"", u"").template
+        self.assertEqual(a, ["template", {}, "a"])
+        self.assertTrue(self.pm.match(u"hello you", u"", u"").template is a)
+        e = self.pm.match(u"goodbye", u"", u"").template
+        self.assertEqual(e, ["template", {}, "e"])
+        self.assertEqual(len(self.pm._templateCache), 1)
+        self.assertFalse(self.pm.match(u"hello you", u"", u"").template is a)
+
+    def _testBrain(self, name):
+        pm = load_brain(name)
+        if pm is None:
+            self.skipTest("brain %s not available" % name)
+        for words, that, topic in sample_inputs(pm, 2000):
+            expected = pm._matchRecursive(words, that, topic, pm._root)
+            got = pm._match(words, that, topic, pm._root)[:2]
+            self.assertEqual(expected, got, msg="brain=%s input=%s that=%s" % (name, words, that))
+
+    def test05_remove( self ):
+        self.assertTrue(self.pm.remove((u"HELLO _ BYE", u"*", u"*")))
+        self.assertFalse(self.pm.remove((u"HELLO _ BYE", u"*", u"*")))
+        self.assertFalse(self.pm.remove((u"HELLO _", u"*", u"*")))
+        self.assertEqual(self.pm.numTemplates(), 4)
+        # the nodes leading only to the template are gone
+        self.assertFalse(self.pm._UNDERSCORE in self.pm._root[u"HELLO"])
+        self.assertEqual(self.pm.match(u"hello you bye", u"", u"").template[2], "a")
+        self.assertTrue(self.pm.remove((u"HELLO BOT_NAME", u"*", u"*")))
+        self.assertTrue(self.pm.remove((u"HELLO *", u"*", u"*")))
+        self.assertFalse(u"HELLO" in self.pm._root)
+        self.assertEqual(self.pm.match(u"hello you", u"", u"").template[2], "e")
+
+    def test09_wildcard_stats( self ):
+        self.pm.add((u"I LIKE * AND *", u"*", u"*"), ["template", {}, "f"])
+        self.pm.add((u"I LIKE _ CATS", u"*", u"*"), ["template", {}, "g"])
+        root = self.pm._root
+        stats = self.pm._wildcardStats
+        hello = root[u"HELLO"][self.pm._UNDERSCORE]
+        self.assertEqual((1, 1, frozenset([u"BYE"]), False), stats(hello))
+        like = root[u"I"][u"LIKE"][self.pm._STAR]
+        self.assertEqual((2, self.pm._MANY, frozenset([u"AND"]), False), stats(like))
+        # a '*' ending the input eats all the words left
+        self.assertEqual((0, 0, frozenset(), False), stats(root[u"HELLO"][self.pm._STAR]))
+        # only the nodes of the current phase are visited
+        self.assertFalse(id(root[self.pm._STAR][self.pm._THAT]) in self.pm._bounds)
+        # adding a category recomputes those leading to it
+        self.pm.add((u"HELLO _ BYE *", u"*", u"*"), ["template", {}, "h"])
+        self.assertTrue(id(like) in self.pm._stats)
+        self.assertFalse(id(hello) in self.pm._stats)
+        self.assertEqual((1, self.pm._MANY, frozenset([u"BYE"]), False), stats(hello))
+        # and so does removing it
+        self.pm.remove((u"HELLO _ BYE *", u"*", u"*"))
+        self.assertEqual((1, 1, frozenset([u"BYE"]), False), stats(hello))
+        # pruning does not change the matches
+        rnd = random.Random(1)
+        vocabulary = [u"I", u"LIKE", u"AND", u"CATS", u"HELLO", u"BYE", u"ROBBIE", u"X"]
+        for n in range(300):
+            words = [rnd.choice(vocabulary) for i in range(rnd.randint(1, 9))]
+            that = [rnd.choice(vocabulary) for i in range(rnd.randint(1, 4))]
+            self.pm._pruneWildcards = False
+            expected = self.pm._match(words, that, [u"X"], root)
+            self.pm._pruneWildcards = True
+            self.assertEqual(expected, self.pm._match(words, that, [u"X"], root), words)
+
+    def test10_old_brain( self ):
+        # brains saved by older versions hold decoded templates, which
+        # are encoded as they are loaded; those of this version are not
+        fd, filename = tempfile.mkstemp(suffix=".brn")
+        os.close(fd)
+        try:
+            with open(filename, "wb") as f:
+                marshal.dump(1, f)
+                marshal.dump(u"ROBBIE", f)
+                marshal.dump({u"HELLO": {self.pm._TEMPLATE: ["template", {}, "a"]}}, f)
+            pm = PatternMgr()
+            pm.restore(filename)
+            self.assertEqual((1, u"ROBBIE"), (pm.numTemplates(), pm._botName))
+            self.assertTrue(isinstance(pm._root[u"HELLO"][pm._TEMPLATE], bytes))
+            self.assertEqual(pm.match(u"hello", u"", u"").template[2], "a")
+            pm.save(filename)
+            with open(filename, "rb") as f:
+                self.assertEqual(PatternMgr._FORMAT, marshal.load(f))
+            pm = PatternMgr()
+            def encode(template):
+                self.fail("template encoded again")
+            pm._encodeTemplate = encode
+            pm.restore(filename)
+            self.assertEqual(pm.match(u"hello", u"", u"").template[2], "a")
+        finally:
+            os.remove(filename)
+
+    def test06_alice( self ):
+        self._testBrain('alice')
+
+    def test07_sara( self ):
+        self._testBrain('sara')
+
+    def test08_alisochka( self ):
+        self._testBrain('alisochka')
+
+
+class TestCompactPatternMgr( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_add_after_match( self ):
+        pm = CompactPatternMgr()
+        pm.add((u"HELLO *", u"*", u"*"), ["template", {}, "a"])
+        self.assertEqual(pm.match(u"hello there", u"", u"").template[2], "a")
+        self.assertEqual(pm._root, None)
+        pm.add((u"HELLO THERE", u"*", u"*"), ["template", {}, "b"])
+        self.assertEqual(pm.match(u"hello there", u"", u"").template[2], "b")
+        self.assertEqual(pm.match(u"hello you", u"", u"").star("star", 1), u"you")
+        self.assertEqual(pm.match(u"goodbye", u"", u""), None)
+        self.assertEqual(pm.numTemplates(), 2)
+
+    def test01_remove_after_match( self ):
+        pm = CompactPatternMgr()
+        pm.add((u"HELLO *", u"*", u"*"), ["template", {}, "a"])
+        pm.add((u"HELLO THERE", u"*", u"*"), ["template", {}, "b"])
+        self.assertEqual(pm.match(u"hello there", u"", u"").template[2], "b")
+        self.assertTrue(pm.remove((u"HELLO THERE", u"*", u"*")))
+        self.assertEqual(pm.match(u"hello there", u"", u"").template[2], "a")
+        self.assertEqual(pm.numTemplates(), 1)
+
+    def test02_bot_name( self ):
+        pm = CompactPatternMgr()
+        pm.add((u"HELLO BOT_NAME", u"*", u"*"), ["template", {}, "a"])
+        pm.setBotName(u"ROBBIE")
+        m = pm.match(u"hello robbie", u"", u"")
+        self.assertEqual(m.template[2], "a")
+        self.assertEqual(m.pattern[:2], [u"HELLO", u"ROBBIE"])
+
+    def test03_save_restore( self ):
+        pm = CompactPatternMgr()
+        pm.add((u"HELLO *", u"*", u"*"), ["template", {}, "a"])
+        pm.match(u"hello", u"", u"")
+        filename = os.path.join(os.path.dirname(__file__), "compact-test.brn")
+        try:
+            pm.save(filename)
+            self.assertEqual(pm._root, None)
+            other = PatternMgr()
+            other.restore(filename)
+            self.assertEqual(other._root, pm._toDict())
+            pm = CompactPatternMgr()
+            pm.restore(filename)
+            self.assertEqual(pm.match(u"hello you", u"", u"").template[2], "a")
+        finally:
+            os.remove(filename)
+
+    def _testBrain(self, name):
+        pm = load_brain(name)
+        cpm = load_brain(name, compact=True)
+        if pm is None:
+            self.skipTest("brain %s not available" % name)
+        self.assertEqual(pm.numTemplates(), cpm.numTemplates())
+        for words, that, topic in sample_inputs(pm, 2000):
+            expected = decoded(pm, pm._match(words, that, topic, pm._matchRoot()))
+            got = decoded(cpm, cpm._match(words, that, topic, cpm._matchRoot()))
+            self.assertEqual(expected, got, msg="brain=%s input=%s that=%s" % (name, words, that))
+
+    def test04_alice( self ):
+        self._testBrain('alice')
+
+    def test05_sara( self ):
+        self._testBrain('sara')
+
+    def test06_alisochka( self ):
+        self._testBrain('alisochka')
+
+
+class TestBrainFile( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".brn")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test01_kernel( self ):
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        k.saveBrain(self.filename, mapped=True)
+        self.assertTrue(BrainFile.isBrainFile(self.filename))
+        k2 = Kernel()
+        k2.verbose(False)
+        k2.loadBrain(self.filename)
+        self.assertTrue(isinstance(k2._brain, CompactPatternMgr))
+        self.assertEqual(k.numCategories(), k2.numCategories())
+        self.assertEqual(k2.respond("test srai"), "srai test passed")
+        self.assertEqual(k2.respond("test star creamy goodness middle"),
+                         "Middle star matched: creamy goodness")
+        # learning on top of a mapped brain
+        k2.learn(os.path.join(os.path.dirname(__file__), "encoding.aiml"))
+        self.assertEqual(k2.respond(u"pattern with Á"), u"pattern #2 matched: Á")
+        self.assertEqual(k2.respond("test srai"), "srai test passed")
+
+    def _testBrain(self, name):
+        pm = load_brain(name)
+        if pm is None:
+            self.skipTest("brain %s not available" % name)
+        CompactPatternMgr.fromPatternMgr(pm).saveMapped(self.filename)
+        mpm = CompactPatternMgr()
+        mpm.restore(self.filename)
+        self.assertEqual(pm.numTemplates(), mpm.numTemplates())
+        for words, that, topic in sample_inputs(pm, 2000):
+            expected = decoded(pm, pm._match(words, that, topic, pm._matchRoot()))
+            got = decoded(mpm, mpm._match(words, that, topic, mpm._matchRoot()))
+            self.assertEqual(expected, got, msg="brain=%s input=%s that=%s" % (name, words, that))
+        # converting back gives the original tree
+        self.assertEqual(mpm._toDict(), pm._root)
+
+    def test02_alice( self ):
+        self._testBrain('alice')
+
+    def test03_sara( self ):
+        self._testBrain('sara')
+
+    def test04_alisochka( self ):
+        self._testBrain('alisochka')
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import os.path
+import multiprocessing
+import signal
+import threading
+import unittest
+from unittest import mock
+
+from aiml import Kernel, KernelPool
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "KernelPool needs fork()")
+class TestKernelPool( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.pool = KernelPool(kernel=self.k, workers=3)
+
+    def tearDown(self):
+        self.pool.close()
+        del self.k
+
+    def test01_respond( self ):
+        self.assertEqual(3, self.pool.numWorkers())
+        self.assertEqual("srai test passed", self.pool.respond("test srai", "a").result())
+
+    def test02_sessions( self ):
+        # each session keeps its predicates and history in its worker
+        sessions = ["s%d" % n for n in range(10)]
+        for s in sessions:
+            self.pool.setPredicate("gender", "male" if s < "s5" else "robot", s)
+        futures = self.pool.respond_many(["test condition"] * 10, sessions)
+        self.assertEqual([f.result() for f in futures],
+                         ["You are handsome"] * 5 + ["You are genderless"] * 5)
+        futures = [self.pool.respond("test thatstar", s) for s in sessions]
+        futures += [self.pool.respond("test thatstar", s) for s in sessions]
+        self.assertEqual([f.result() for f in futures],
+                         ["I say beans"] * 10 + ["I just said \"beans\""] * 10)
+        self.assertEqual(self.pool.getPredicate("gender", "s7").result(), "robot")
+
+    def test03_respond_many( self ):
+        inputs = ["test srai", "test bot", "test star begin", "test version"] * 5
+        sessions = ["s%d" % (i % 7) for i in range(len(inputs))]
+        futures = self.pool.respond_many(inputs, sessions)
+        serial = Kernel()
+        serial.verbose(False)
+        serial.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        expected = [serial.respond(i, s) for i, s in zip(inputs, sessions)]
+        self.assertEqual(expected, [f.result() for f in futures])
+        self.assertRaises(ValueError, self.pool.respond_many, inputs, sessions[1:])
+
+    def test04_closed( self ):
+        self.pool.close()
+        self.assertRaises(RuntimeError, self.pool.respond, "test srai", "a")
+        self.assertRaises(RuntimeError, self.pool.getPredicate, "gender", "a")
+        self.assertRaises(RuntimeError, self.pool.respond_many, ["test srai"], ["a"])
+
+    def test05_worker_killed( self ):
+        # the requests sent to a dead worker fail, instead of the send
+        worker = self.pool._worker("a")
+        os.kill(worker.process.pid, signal.SIGKILL)
+        worker.process.join()
+        for n in range(2):
+            future = self.pool.respond("test srai", "a")
+            self.assertRaises(RuntimeError, future.result, 5)
+            self.assertEqual("Kernel worker exited", str(future.exception()))
+        self.assertEqual({}, worker.pending)
+        # the other workers still answer
+        sessions = [s for s in ("s%d" % n for n in range(10))
+                    if self.pool._worker(s) is not worker]
+        self.assertEqual("srai test passed", self.pool.respond("test srai", sessions[0]).result())
+
+    def test06_fork_first( self ):
+        # every worker is forked before any thread of the pool starts
+        process = multiprocessing.get_context("fork").Process
+        start = process.start
+        threads = []
+        def countingStart(p):
+            threads.append(threading.active_count())
+            start(p)
+        with mock.patch.object(process, "start", countingStart):
+            pool = KernelPool(kernel=self.k, workers=3)
+        try:
+            self.assertEqual([threading.active_count() - 3] * 3, threads)
+            self.assertEqual("srai test passed", pool.respond("test srai", "a").result())
+        finally:
+            pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,7 @@
 from __future__ import print_function
 import time
 import os.path
+import threading
 import unittest
 
 from aiml import Utils
@@ -22,3 +23,22 @@ class TestUtils( unittest.TestCase ):
         sents = Utils.sentences("First.  Second, still?  Third and Final!  Well, not really")
         self.assertEqual( 4, len(sents) )
 
+    def test_read_write_lock( self ):
+        lock = Utils.ReadWriteLock()
+        events = []
+        def reader():
+            with lock.reading():
+                events.append("reader in")
+                time.sleep(0.1)
+                events.append("reader out")
+        # readers share the lock, and a reader may take the write lock
+        # once the others are done
+        with lock.reading():
+            t = threading.Thread(target=reader)
+            t.start()
+            time.sleep(0.05)
+            self.assertEqual(events, ["reader in"])
+            with lock.writing():
+                events.append("write")
+            t.join()
+        self.assertEqual(events, ["reader in", "reader out", "write"])
@@ -33,3 +33,17 @@ class TestWordSub( unittest.TestCase ):
         outStr = "I Would like one banana, one Pear and one APPLE."
         self.assertEqual( outStr, self.subber.sub(inStr) )
 
+
+    def test03_trie( self ):
+        '''test the trie gives the same output as the regex'''
+        trieSubber = WordSub()
+        trieSubber._trieMinKeys = 0
+        for subber in (self.subber, trieSubber):
+            for k, v in [("apple", "banana"), ("orange", "pear"), ("banana", "apple"),
+                         ("he", "she"), ("I'd", "I would"), ("y.", "z"), (" x", "y")]:
+                subber[k] = v
+        for inStr in ["He said he'd like to go with me", "",
+                      "I'd like one apple, one Orange and one BANANA.",
+                      "y.z y. x x  x", "he'dhe he_he 'he' HE'D"]:
+            self.assertEqual( self.subber.sub(inStr), trieSubber.sub(inStr), inStr )
+        self.assertIsNotNone( trieSubber._trie )
@@ -0,0 +1,338 @@
+'''
+A compiler from AIML template element trees to Python closures.
+
+Kernel._processElement() interprets a template by looking up a handler
+for every element each time a response is generated.  The compiler
+walks each template once and builds a closure for every element, with
+the element's attributes already parsed and its children already
+resolved, so producing a response is a plain chain of function calls
+joining their outputs.
+
+Elements whose semantics are rarely worth compiling (<system>,
+<learn>, ...), unknown elements and elements whose handler has been
+replaced in Kernel._elementProcessors are handed back to the Kernel's
+interpreter, so compiled templates always give the same result as
+interpreted ones.
+'''
+
+from __future__ import print_function
+
+from collections import OrderedDict
+import random
+import re
+import string
+import sys
+import threading
+import time
+
+
+class TemplateCompiler:
+    # number of compiled templates to keep
+    _cacheSize = 4096
+
+    def __init__(self, kernel):
+        self._kernel = kernel
+        self._cache = OrderedDict()
+        self._cacheLock = threading.Lock()
+        self._whitespaceRE = re.compile(r"\s+")
+        # element name -> (Kernel handler name, compile method)
+        self._compilers = {
+            "bot":          ("_processBot",         self._compileBot),
+            "condition":    ("_processCondition",   self._compileCondition),
+            "date":         ("_processDate",        self._compileDate),
+            "formal":       ("_processFormal",      self._compileFormal),
+            "gender":       ("_processGender",      self._compileGender),
+            "get":          ("_processGet",         self._compileGet),
+            "id":           ("_processId",          self._compileId),
+            "input":        ("_processInput",       self._compileInput),
+            "li":           ("_processLi",          self._compileContents),
+            "lowercase":    ("_processLowercase",   self._compileLowercase),
+            "person":       ("_processPerson",      self._compilePerson),
+            "person2":      ("_processPerson2",     self._compilePerson),
+            "random":       ("_processRandom",      self._compileRandom),
+            "text":         ("_processText",        self._compileText),
+            "sentence":     ("_processSentence",    self._compileSentence),
+            "set":          ("_processSet",         self._compileSet),
+            "size":         ("_processSize",        self._compileSize),
+            "sr":           ("_processSr",          self._compileSr),
+            "srai":         ("_processSrai",        self._compileSrai),
+            "star":         ("_processStar",        self._compileStar),
+            "template":     ("_processTemplate",    self._compileContents),
+            "that":         ("_processThat",        self._compileThat),
+            "thatstar":     ("_processThatstar",    self._compileStar),
+            "think":        ("_processThink",       self._compileThink),
+            "topicstar":    ("_processTopicstar",   self._compileStar),
+            "uppercase":    ("_processUppercase",   self._compileUppercase),
+            "version":      ("_processVersion",     self._compileVersion),
+        }
+        # the handlers the cached templates were compiled against
+        self._names = sorted(self._compilers)
+        self._handlers = None
+
+    def setCacheSize(self, size):
+        """Set the number of compiled templates to keep."""
+        with self._cacheLock:
+            self._cacheSize = size
+            while len(self._cache) > size:
+                self._cache.popitem(last=False)
+
+    def run(self, match, sessionID):
+        """Return the response for the template selected by match (a
+        PatternMgr Match), compiling the template first if it isn't in
+        the cache.
+
+        Compiled templates are keyed on the template as stored in the
+        brain, so a cached template is never decoded again.  They are
+        all dropped as soon as a handler in Kernel._elementProcessors
+        changes.
+        """
+        key = match.data
+        cache = self._cache
+        handlers = tuple(map(self._kernel._elementProcessors.get, self._names))
+        with self._cacheLock:
+            if handlers != self._handlers:
+                cache.clear()
+                self._handlers = handlers
+            template = cache.pop(key, None)
+        if template is None:
+            template = self.compile(match.template)
+        with self._cacheLock:
+            cache[key] = template
+            if len(cache) > self._cacheSize:
+                cache.popitem(last=False)
+        return template(sessionID)
+
+    def compile(self, elem):
+        """Return a function of sessionID that produces the same string as
+        Kernel._processElement(elem, sessionID).
+        """
+        try:
+            handlerName, compiler = self._compilers[elem[0]]
+            handler = self._kernel._elementProcessors[elem[0]]
+        except Exception:
+            return self._interpret(elem)
+        if handler != getattr(self._kernel, handlerName):
+            # a user-supplied handler
+            return self._interpret(elem)
+        return compiler(elem)
+
+    def _interpret(self, elem):
+        processElement = self._kernel._processElement
+        def interpreted(sessionID):
+            return processElement(elem, sessionID)
+        return interpreted
+
+    def _join(self, elems):
+        """Compile a list of elements into a function returning their
+        concatenated output."""
+        parts = [self.compile(e) for e in elems]
+        if len(parts) == 0:
+            return lambda sessionID: ""
+        if len(parts) == 1:
+            return parts[0]
+        def joined(sessionID):
+            return "".join([part(sessionID) for part in parts])
+        return joined
+
+    def _index(self, elem):
+        """Return the integer 'index' attribute of elem, defaulting to 1."""
+        try: return int(elem[1]['index'])
+        except KeyError: return 1
+
+    # The compile methods follow the Kernel._process* handlers of the
+    # same names.
+
+    def _compileBot(self, elem):
+        name = elem[1]['name']
+        getBotPredicate = self._kernel.getBotPredicate
+        return lambda sessionID: getBotPredicate(name)
+
+    def _compileCondition(self, elem):
+        kernel = self._kernel
+        attr = elem[1]
+        if 'name' in attr and 'value' in attr:
+            name, value = attr['name'], attr['value']
+            contents = self._join(elem[2:])
+            def condition(sessionID):
+                if kernel.getPredicate(name, sessionID) == value:
+                    return contents(sessionID)
+                return ""
+            return condition
+
+        name = attr.get('name', None)
+        listitems = [e for e in elem[2:] if e[0] == 'li']
+        if len(listitems) == 0:
+            return lambda sessionID: ""
+        tests = []
+        for li in listitems:
+            liAttr = li[1]
+            if len(liAttr) == 0 and li == listitems[-1]:
+                continue
+            try:
+                liName = name if name is not None else liAttr['name']
+                liValue = liAttr['value']
+            except Exception:
+                # malformed list item; let the interpreter complain
+                return self._interpret(elem)
+            tests.append((liName, liValue, self.compile(li)))
+        default = None
+        last = listitems[-1][1]
+        if not ('name' in last or 'value' in last):
+            default = self.compile(listitems[-1])
+        def condition(sessionID):
+            for liName, liValue, li in tests:
+                if kernel.getPredicate(liName, sessionID) == liValue:
+                    return li(sessionID)
+            if default is not None:
+                return default(sessionID)
+            return ""
+        return condition
+
+    def _compileDate(self, elem):
+        return lambda sessionID: time.asctime()
+
+    def _compileFormal(self, elem):
+        contents = self._join(elem[2:])
+        return lambda sessionID: string.capwords(contents(sessionID))
+
+    def _compileGender(self, elem):
+        contents = self._join(elem[2:])
+        kernel = self._kernel
+        return lambda sessionID: kernel._subbers['gender'].sub(contents(sessionID))
+
+    def _compileGet(self, elem):
+        name = elem[1]['name']
+        getPredicate = self._kernel.getPredicate
+        return lambda sessionID: getPredicate(name, sessionID)
+
+    def _compileId(self, elem):
+        return lambda sessionID: sessionID
+
+    def _compileInput(self, elem):
+        kernel = self._kernel
+        try: index = int(elem[1]['index'])
+        except: index = 1
+        def input_(sessionID):
+            inputHistory = kernel.getPredicate(kernel._inputHistory, sessionID)
+            try: return inputHistory[-index]
+            except IndexError:
+                if kernel._verboseMode:
+                    err = "No such index %d while processing <input> element.\n" % index
+                    sys.stderr.write(err)
+                return ""
+        return input_
+
+    def _compileContents(self, elem):
+        return self._join(elem[2:])
+
+    def _compileLowercase(self, elem):
+        contents = self._join(elem[2:])
+        return lambda sessionID: contents(sessionID).lower()
+
+    def _compilePerson(self, elem):
+        if len(elem[2:]) == 0:  # atomic <person/> = <person><star/></person>
+            contents = self.compile(['star', {}])
+        else:
+            contents = self._join(elem[2:])
+        kernel = self._kernel
+        which = elem[0]
+        return lambda sessionID: kernel._subbers[which].sub(contents(sessionID))
+
+    def _compileRandom(self, elem):
+        listitems = [self.compile(e) for e in elem[2:] if e[0] == 'li']
+        if len(listitems) == 0:
+            return lambda sessionID: ""
+        def random_(sessionID):
+            # shuffle a copy, so the random module is used exactly as the
+            # interpreter uses it
+            items = list(listitems)
+            random.shuffle(items)
+            return items[0](sessionID)
+        return random_
+
+    def _compileText(self, elem):
+        try:
+            elem[2] + ""
+        except TypeError:
+            return self._interpret(elem)
+        text = elem[2]
+        if elem[1]["xml:space"] == "default":
+            text = self._whitespaceRE.sub(" ", text)
+        return lambda sessionID: text
+
+    def _compileSentence(self, elem):
+        contents = self._join(elem[2:])
+        def sentence(sessionID):
+            response = contents(sessionID).strip()
+            words = response.split(" ", 1)
+            words[0] = words[0].capitalize()
+            return ' '.join(words)
+        return sentence
+
+    def _compileSet(self, elem):
+        name = elem[1]['name']
+        contents = self._join(elem[2:])
+        setPredicate = self._kernel.setPredicate
+        def set_(sessionID):
+            value = contents(sessionID)
+            setPredicate(name, value, sessionID)
+            return value
+        return set_
+
+    def _compileSize(self, elem):
+        numCategories = self._kernel.numCategories
+        return lambda sessionID: str(numCategories())
+
+    def _compileSr(self, elem):
+        star = self.compile(['star', {}])
+        respond = self._kernel._respond
+        return lambda sessionID: respond(star(sessionID), sessionID)
+
+    def _compileSrai(self, elem):
+        contents = self._join(elem[2:])
+        respond = self._kernel._respond
+        return lambda sessionID: respond(contents(sessionID), sessionID)
+
+    def _compileStar(self, elem):
+        kernel = self._kernel
+        try: index = self._index(elem)
+        except ValueError:
+            return self._interpret(elem)
+        starType = elem[0]
+        def star(sessionID):
+            matchStack = kernel.getPredicate(kernel._matchStack, sessionID)
+            return matchStack[-1].star(starType, index)
+        return star
+
+    def _compileThat(self, elem):
+        kernel = self._kernel
+        index = 1
+        try:
+            index = int(elem[1]['index'].split(',')[0])
+        except Exception:
+            pass
+        def that(sessionID):
+            outputHistory = kernel.getPredicate(kernel._outputHistory, sessionID)
+            try: return outputHistory[-index]
+            except IndexError:
+                if kernel._verboseMode:
+                    err = "No such index %d while processing <that> element.\n" % index
+                    sys.stderr.write(err)
+                return ""
+        return that
+
+    def _compileThink(self, elem):
+        contents = [self.compile(e) for e in elem[2:]]
+        def think(sessionID):
+            for e in contents:
+                e(sessionID)
+            return ""
+        return think
+
+    def _compileUppercase(self, elem):
+        contents = self._join(elem[2:])
+        return lambda sessionID: contents(sessionID).upper()
+
+    def _compileVersion(self, elem):
+        version = self._kernel.version
+        return lambda sessionID: version()
@@ -3,6 +3,9 @@ modules in the PyAIML package.
 
 """
 
+from contextlib import contextmanager
+import threading
+
 def sentences(s):
     """Split the string s into a list of sentences."""
     try: s+""
@@ -25,3 +28,85 @@ def sentences(s):
     if len(sentenceList) == 0: sentenceList.append(s)
     return sentenceList
 
+
+class ReadWriteLock(object):
+    """A lock that can be held by any number of readers at once, or by
+    a single writer.
+
+    Both kinds of lock are reentrant.  A thread holding read locks may
+    also take the write lock: its read locks are given up while it
+    waits for the other readers to finish, and given back when it
+    releases the write lock.  Waiting writers take precedence over new
+    readers, so that they are not starved.
+
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}       # thread -> number of read locks held
+        self._writer = None      # thread holding the write lock
+        self._writerDepth = 0
+        self._writerReads = 0    # read locks given up by the writer
+        self._waitingWriters = 0
+
+    def acquireRead(self):
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is not me and me not in self._readers:
+                while self._writer is not None or self._waitingWriters:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def releaseRead(self):
+        me = threading.current_thread()
+        with self._cond:
+            self._readers[me] -= 1
+            if self._readers[me] == 0:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquireWrite(self):
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self._writerDepth += 1
+                return
+            reads = self._readers.pop(me, 0)
+            if reads:
+                self._cond.notify_all()
+            self._waitingWriters += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._waitingWriters -= 1
+            self._writer = me
+            self._writerDepth = 1
+            self._writerReads = reads
+
+    def releaseWrite(self):
+        me = threading.current_thread()
+        with self._cond:
+            self._writerDepth -= 1
+            if self._writerDepth > 0:
+                return
+            if self._writerReads:
+                self._readers[me] = self._readers.get(me, 0) + self._writerReads
+            self._writer = None
+            self._writerReads = 0
+            self._cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        """Context manager holding a read lock."""
+        self.acquireRead()
+        try:
+            yield
+        finally:
+            self.releaseRead()
+
+    @contextmanager
+    def writing(self):
+        """Context manager holding the write lock."""
+        self.acquireWrite()
+        try:
+            yield
+        finally:
+            self.releaseWrite()
@@ -20,6 +20,10 @@ The following example illustrates this point:
     she says she'd like to help her
 Note that "he" and "he'd" were replaced, but "help" and "her" were
 not.
+
+The regex alternation tries the keys one by one at every position, so
+a subber with many keys looks them up in a trie of tokens instead; the
+output is the same.
 """
 
 from __future__ import print_function
@@ -38,9 +42,20 @@ try:
 except ImportError:
     from configparser import ConfigParser
 
+# a word character, as '\b' in the regex alternation sees it
+_wordChar = re.compile(r"\w")
+# splits a string into tokens: runs of word characters, and single
+# other characters
+_tokens = re.compile(r"\w+|\W", re.DOTALL).findall
+
 class WordSub(dict):
     """All-in-one multiple-string-substitution class."""
 
+    # Number of keys (counting their case variants) from which sub()
+    # walks a trie of the keys rather than the regex alternation, whose
+    # cost grows with every key.
+    _trieMinKeys = 64
+
     def _wordToRegex(self, word):
         """Convert a word to a regex object which matches the word."""
         if word != "" and word[0].isalpha() and word[-1].isalpha():
@@ -54,7 +69,37 @@ class WordSub(dict):
 
         """
         self._regex = re.compile("|".join(map(self._wordToRegex, self.keys())))
+
+    def _update_trie(self):
+        """Build the trie of the keys of the current dictionary, which
+        sub() walks instead of trying every key in turn (or, with fewer
+        than _trieMinKeys keys, the regex).
+
+        Texts and keys are split into tokens: runs of word characters,
+        and single other characters.  A key can only match a whole
+        number of tokens, since it starts and ends on a word boundary,
+        so the trie's edges are tokens.  Each key ends at a node holding
+        (priority, key, whether it needs a word before it, whether it
+        needs a word after it); the priority is the key's position in
+        the regex alternation, so that the same key wins when several
+        match at the same place.
+
+        """
         self._regexIsDirty = False
+        if len(self) < self._trieMinKeys or "" in self:
+            # the regex is faster for a few keys, and only the regex
+            # handles empty matches the regex way
+            self._trie = None
+            self._update_regex()
+            return
+        trie = {}
+        for priority, key in enumerate(self.keys()):
+            node = trie
+            for token in _tokens(key):
+                node = node.setdefault(token, {})
+            node[None] = (priority, key, _wordChar.match(key[0]) is None,
+                          _wordChar.match(key[-1]) is None)
+        self._trie = trie
 
     def __init__(self, defaults = {}):
         """Initialize the object, and populate it with the entries in
@@ -62,6 +107,7 @@ class WordSub(dict):
 
         """
         self._regex = None
+        self._trie = None
         self._regexIsDirty = True
         for k,v in defaults.items():
             self[k] = v
@@ -80,6 +126,44 @@ class WordSub(dict):
     def sub(self, text):
         """Translate text, returns the modified text."""
         if self._regexIsDirty:
-            self._update_regex()
-        return self._regex.sub(self, text)
+            self._update_trie()
+        trie = self._trie
+        if trie is None:
+            return self._regex.sub(self, text)
+
+        # At each token, walk the trie along the following tokens, and
+        # replace the first key of the alternation that matches there
+        # on word boundaries.
+        tokens = _tokens(text)
+        n = len(tokens)
+        pieces = []
+        last = 0
+        i = 0
+        while i < n:
+            node = trie.get(tokens[i])
+            if node is None:
+                i += 1
+                continue
+            best = None
+            j = i
+            while node is not None:
+                j += 1
+                term = node.get(None)
+                if (term is not None and (best is None or term[0] < best[0]) and
+                    (not term[2] or (i > 0 and _wordChar.match(tokens[i-1]))) and
+                    (not term[3] or (j < n and _wordChar.match(tokens[j])))):
+                    best = (term[0], term[1], j)
+                if j == n:
+                    break
+                node = node.get(tokens[j])
+            if best is None:
+                i += 1
+                continue
+            pieces.append("".join(tokens[last:i]))
+            pieces.append(self[best[1]])
+            i = last = best[2]
+        if not pieces:
+            return text
+        pieces.append("".join(tokens[last:]))
+        return text[:0].join(pieces)
 
@@ -2,3 +2,6 @@ __all__ = []
 
 # The Kernel class is the only class most implementations should need.
 from .Kernel import Kernel
+
+# KernelPool answers with several worker processes sharing one brain.
+from .KernelPool import KernelPool
@@ -8,6 +8,7 @@ import os.path
 import sys
 import argparse
 import io
+import time
 
 import aiml
 
@@ -47,7 +48,8 @@ def read_args():
     g3.add_argument( '--interactive', '-i', action='store_true',
                      help='Enter interactive mode' )
     g3.add_argument( '--batch', '-b',
-                     help='Send a series of inputs to the bot' )
+                     help='Send a series of inputs to the bot, one per line, '
+                          'optionally preceded by a session name and a tab' )
 
     return parser.parse_args()
 
@@ -81,11 +83,26 @@ def main():
     if args.save:
         kern.saveBrain(args.save)
     if args.batch:
+        inputs, sessions = [], []
         with io.open( args.batch, 'rt' ) as fin:
             for line in fin:
-                line = line.rstrip()
-                print( ">", line )
-                print( "<", kern.respond(line) )
+                session, _, line = line.rstrip().rpartition( '\t' )
+                inputs.append( line )
+                sessions.append( session or kern._globalSessionID )
+        start = time.time()
+        results = kern.respond_batch( inputs, sessions )
+        elapsed = time.time() - start
+        for line, result in zip( inputs, results ):
+            print( ">", line )
+            print( "<", result.response )
+        print( "%d inputs in %.2f seconds (%.0f inputs/s)"
+               % (len(inputs), elapsed, len(inputs) / elapsed if elapsed else 0),
+               file=sys.stderr )
+        if results:
+            slowest = max( range(len(results)), key=lambda i: results[i].seconds )
+            print( "slowest: %.1f ms for '%s'"
+                   % (1000 * results[slowest].seconds, inputs[slowest]),
+                   file=sys.stderr )
     if args.interactive:
         # Enter the main input/output loop.
         print( "\nINTERACTIVE MODE (ctrl-c to exit)" )
@@ -0,0 +1,43 @@
+"""
+Convert a brain file between the marshal format written by
+Kernel.saveBrain() and the memory-mapped format written by
+Kernel.saveBrain(mapped=True).  Converting a brain written by an older
+version to the marshal format brings it up to date, so that loading it
+no longer converts its templates.
+
+Usage:
+    brainconvert.py [--to {mapped,marshal}] input.brn output.brn
+"""
+from __future__ import print_function
+
+import argparse
+
+import aiml
+from aiml import BrainFile
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Convert AIML brain files')
+    parser.add_argument( '--to', choices=['mapped', 'marshal'],
+                         help='Output format (default: the other one)' )
+    parser.add_argument( 'input', help='Brain file to read' )
+    parser.add_argument( 'output', help='Brain file to write' )
+    return parser.parse_args()
+
+
+def main():
+    args = read_args()
+    to = args.to
+    if to is None:
+        to = 'marshal' if BrainFile.isBrainFile(args.input) else 'mapped'
+
+    kern = aiml.Kernel(compactBrain=True)
+    kern.loadBrain(args.input)
+    kern.saveBrain(args.output, mapped=(to == 'mapped'))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,23 +18,217 @@
 # A simple hack to attach a chatterbot to speak activity
 #coding=utf-8
 
-from aiml.Kernel import Kernel
+# Learns each bot's AIML files, parsing them in parallel worker processes,
+# and writes its brain file.  Run from this directory.
+#
+# Next to each brain, a manifest (<bot>.manifest.json) records the hash of
+# every AIML file and the categories it defines.  With --incremental, only
+# the files changed since are parsed again, and their categories removed
+# from and added back to the existing brain.
+
+from __future__ import print_function
+
+import argparse
 import glob
+import hashlib
+import json
+import marshal
+import os
+import sys
+import time
+
+from aiml.Kernel import Kernel
+
+BRAINS = ['sara', 'alice', 'alisochka']
+MANIFEST_VERSION = 1
+
+
+def report(filename, done, total, seconds):
+    print('  [%*d/%d] %s (%.2f seconds)' % (len(str(total)), done, total,
+                                           filename, seconds))
+
+
+def aiml_files(name):
+    """Return the AIML files of a bot, in the order they are learned."""
+    return sorted(glob.glob("%s/*.aiml" % name))  # devuelve lista con ficheros *.aiml
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def manifest_name(name):
+    return "%s.manifest.json" % name
+
+
+def parse(k, filenames, jobs, progress=None):
+    """Parse AIML files, and return a dict of the categories of each."""
+    parsed = {}
+    for done, (f, categories, err, seconds) in enumerate(k.parseFiles(filenames, jobs), 1):
+        if categories is None:
+            sys.stderr.write("FATAL PARSE ERROR in file %s:\n%s\n" % (f, err))
+            categories = []
+        parsed[f] = categories
+        if progress is not None:
+            progress(f, done, len(filenames), seconds)
+    return parsed
+
+
+def owners(filenames, keys):
+    """Return a dict of the file each category is learned from: the
+    last one defining it."""
+    owner = {}
+    for f in filenames:
+        for key in keys[f]:
+            owner[key] = f
+    return owner
+
+
+def decoded(node):
+    """Return a brain's node tree with its templates decoded."""
+    if isinstance(node, dict):
+        return dict((key, decoded(child)) for key, child in node.items())
+    if isinstance(node, bytes):
+        return marshal.loads(node)
+    return node
+
+
+def same_brain(k1, k2):
+    """Tell whether two kernels learned the same categories.  Their
+    brain files may still differ in marshal's sharing of objects."""
+    for k in (k1, k2):
+        if k._brain._root is None:
+            k._brain._thaw()    # a memory-mapped brain
+    return (k1._brain.numTemplates() == k2._brain.numTemplates() and
+            decoded(k1._brain._root) == decoded(k2._brain._root))
+
+
+def build(name, jobs, progress=None):
+    """Learn the AIML files of a bot, in a stable order, and return the
+    kernel, its manifest and the seconds it took."""
+    k = Kernel()
+    k.verbose(False)
+    files = aiml_files(name)
+    start = time.time()
+    manifest = []
+    for done, (f, categories, err, seconds) in enumerate(k.parseFiles(files, jobs), 1):
+        if categories is None:
+            sys.stderr.write("FATAL PARSE ERROR in file %s:\n%s\n" % (f, err))
+            categories = []
+        k.learnCategories(categories)
+        manifest.append({'file': f, 'sha1': file_hash(f),
+                         'categories': [list(key) for key, tem in categories]})
+        if progress is not None:
+            progress(f, done, len(files), seconds)
+    return k, manifest, time.time() - start
+
+
+def rebuild(name, jobs, progress=None):
+    """Bring the brain of a bot up to date with its AIML files, parsing
+    only the files changed since its manifest was written.
+
+    Returns the kernel, its manifest and the seconds it took, or None
+    if there is no previous brain and manifest to start from.
+    """
+    try:
+        with open(manifest_name(name)) as f:
+            old = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if old.get('version') != MANIFEST_VERSION or not os.path.exists("%s.brn" % name):
+        return None
+    start = time.time()
+    k = Kernel()
+    k.verbose(False)
+    k.loadBrain("%s.brn" % name)
+
+    oldFiles = [entry['file'] for entry in old['files']]
+    oldHashes = dict((entry['file'], entry['sha1']) for entry in old['files'])
+    oldKeys = dict((entry['file'], [tuple(key) for key in entry['categories']])
+                   for entry in old['files'])
+    files = aiml_files(name)
+    hashes = dict((f, file_hash(f)) for f in files)
+    changed = [f for f in files if oldHashes.get(f) != hashes[f]]
+    gone = [f for f in oldFiles if f not in hashes]
+    parsed = parse(k, changed, jobs, progress)
+    keys = dict((f, [key for key, tem in parsed[f]] if f in parsed else oldKeys[f])
+                for f in files)
+
+    # The categories of the changed and deleted files now come from the
+    # last file still defining them, if any.
+    oldOwner = owners(oldFiles, oldKeys)
+    owner = owners(files, keys)
+    affected = set()
+    for f in changed + gone:
+        affected.update(oldKeys.get(f, ()))
+        affected.update(keys.get(f, ()))
+    forget = []
+    wanted = {}
+    for key in affected:
+        f = owner.get(key)
+        if f is None:
+            if key in oldOwner:
+                forget.append(key)
+        elif f in parsed or f != oldOwner.get(key):
+            wanted.setdefault(f, set()).add(key)
+    # an unchanged file whose categories were overridden by a changed
+    # file must be parsed again to get them back.
+    parsed.update(parse(k, sorted(f for f in wanted if f not in parsed), jobs, progress))
+
+    k.unlearn(forget)
+    for f in files:
+        if f in wanted:
+            k.learnCategories([(key, tem) for key, tem in parsed[f] if key in wanted[f]])
+    manifest = [{'file': f, 'sha1': hashes[f], 'categories': [list(key) for key in keys[f]]}
+                for f in files]
+    print('%s: %d of %d files parsed, %d categories forgotten, %d learned' % (
+        name, len(parsed), len(files), len(forget), sum(len(v) for v in wanted.values())))
+    return k, manifest, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the bot brains')
+    parser.add_argument('brains', nargs='*', metavar='BRAIN',
+                        help='brains to generate, among %s (default: all)' % ', '.join(BRAINS))
+    parser.add_argument('--mapped', action='store_true',
+                        help='write memory-mapped brain files')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of processes parsing AIML files '
+                             '(default: one per CPU)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only parse the AIML files changed since the '
+                             'last build, and update its brain')
+    parser.add_argument('--compare', action='store_true',
+                        help='also learn each brain from scratch in a single process, '
+                             'check that both brains are identical and compare the times')
+    args = parser.parse_args()
+    for name in args.brains:
+        if name not in BRAINS:
+            parser.error('unknown brain: %s' % name)
+
+    for name in args.brains or BRAINS:
+        print('Learning %s...' % name)
+        result = None
+        if args.incremental:
+            result = rebuild(name, args.jobs, report)
+            if result is None:
+                print('%s: no previous build, learning all files' % name)
+        if result is None:
+            result = build(name, args.jobs, report)
+        k, manifest, elapsed = result
+        k.saveBrain("%s.brn" % name, mapped=args.mapped)
+        with open(manifest_name(name), 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': manifest}, f)
+        print('%s learned in %.2f seconds' % (name, elapsed))
+
+        if args.compare:
+            serial, serialManifest, serialElapsed = build(name, 1)
+            same = same_brain(k, serial) and manifest == serialManifest
+            print('%s: %.2f seconds, %.2f seconds from scratch serially (x%.1f), %s' % (
+                name, elapsed, serialElapsed, serialElapsed / elapsed,
+                'identical brains' if same else 'BRAINS DIFFER'))
+
 
-k = Kernel()
-laiml = glob.glob("sara/*.aiml") #devuelve lista con ficheros *.aiml
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("sara.brn")
-
-k = Kernel()
-laiml = glob.glob("alice/*.aiml") #devuelve lista con ficheros *.aiml
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("alice.brn")
-
-k = Kernel()
-laiml = glob.glob("alisochka/*.aiml")
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("alisochka.brn")
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,8 @@
 #     License along with HablarConSara.activity.  If not, see
 #     <http://www.gnu.org/licenses/>.
 
+import asyncio
+import threading
 import time
 from gettext import gettext as _
 
@@ -61,6 +63,8 @@ if get_mem_info('MemTotal:') < 524288:
 
 _kernel = None
 _kernel_voice = None
+_loop = None
+_turn = None
 
 
 def _get_age():
@@ -92,6 +96,54 @@ def respond(text):
     return text
 
 
+def _get_loop():
+    # The bot thinks in an asyncio loop of its own, in a thread, while
+    # the GLib loop keeps the UI responsive.
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=_loop.run_forever)
+        thread.daemon = True
+        thread.start()
+    return _loop
+
+
+async def _respond_in_turn(text):
+    # Answer after the questions asked before, in the order asked;
+    # asyncio.Lock wakes its waiters first come, first served.
+    global _turn
+    if _turn is None:
+        _turn = asyncio.Lock()
+    async with _turn:
+        if _kernel is None:
+            return None
+        return await _kernel.respond_async(text)
+
+
+def respond_async(text, callback):
+    """Compute the response to text without blocking the GLib loop,
+    then call callback with it from the GLib loop.  Questions asked
+    while an answer is being computed wait for it, and every question
+    is answered, in the order they were asked."""
+    if _kernel is None:
+        GLib.idle_add(callback, respond(text))
+        return
+
+    def done(future):
+        try:
+            text = future.result()
+        except Exception:
+            logger.exception('Error while responding')
+            text = None
+        if not text:
+            text = _("Sorry, I can't understand what you are asking about.")
+        GLib.idle_add(callback, text)
+
+    future = asyncio.run_coroutine_threadsafe(
+        _respond_in_turn(text), _get_loop())
+    future.add_done_callback(done)
+
+
 def load(activity, voice, sorry=None):
     old_cursor = activity.get_window().get_cursor()
     activity.get_window().set_cursor(Gdk.Cursor(Gdk.CursorType.WATCH))